@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import webbrowser
+from enum import Enum
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from time import time
+from urllib.parse import parse_qs, urlencode, urlparse
+
+TOKEN_PATH = 'token.json'
+REFRESH_MARGIN = 5*60
+RETRY_INTERVAL = 60
+REDIRECT_PORT = 7270
+REDIRECT_URI = f'http://localhost:{REDIRECT_PORT}'
+
+
+class AuthorizationError(Exception):
+    pass
+
+
+class OsuAuthenticationMode(Enum):
+    CLIENT_CREDENTIALS = 1
+    AUTHORIZATION_CODE = 2
+
+
+class Token:
+
+    def __init__(self, token_type, access_token, expires, refresh_token=None):
+        self.token_type = token_type
+        self.access_token = access_token
+        self.expires = expires
+        self.refresh_token = refresh_token
+
+    @classmethod
+    def from_response(cls, data):
+        return cls(data['token_type'], data['access_token'],
+                   time() + data['expires_in'], data.get('refresh_token'))
+
+    def valid(self, margin=0):
+        return time() + margin < self.expires
+
+    @property
+    def headers(self):
+        return {'Authorization': f'{self.token_type} {self.access_token}'}
+
+
+class OsuAuth:
+
+    def __init__(self, client_id, client_secret, mode, oauth_url, path=TOKEN_PATH, on_refresh=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.mode = mode
+        self.oauth_url = oauth_url
+        self.path = Path(path)
+        self.key = f'{client_id}:{mode.name}'
+        self.token = None
+        self.on_refresh = on_refresh
+        self.retry_at = 0
+        self.session = None
+        self.lock = asyncio.Lock()
+        self.refresher = None
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)[self.key]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+        return Token(**data)
+
+    def save(self):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        data[self.key] = vars(self.token)
+
+        partial = self.path.with_suffix('.part')
+        fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file)
+        os.replace(partial, self.path)
+
+    async def start(self, session):
+        self.session = session
+        self.token = self.load()
+        if self.token is None or not self.token.valid(REFRESH_MARGIN):
+            await self.refresh(interactive=True)
+        self.refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self.refresher is not None:
+            self.refresher.cancel()
+            await asyncio.gather(self.refresher, return_exceptions=True)
+            self.refresher = None
+        self.session = None
+
+    @property
+    def headers(self):
+        return self.token.headers
+
+    async def ensure(self):
+        if self.token is None or not self.token.valid(REFRESH_MARGIN):
+            await self.refresh()
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(max(0, self.token.expires - REFRESH_MARGIN - time()))
+            try:
+                await self.refresh()
+            except Exception:
+                import traceback
+                traceback.print_exc()
+                await asyncio.sleep(RETRY_INTERVAL)
+
+    async def refresh(self, interactive=False):
+        async with self.lock:
+            if self.token is not None and self.token.valid(REFRESH_MARGIN):
+                return
+            if not interactive and time() < self.retry_at:
+                raise AuthorizationError("osu! token refresh is backing off after a failure")
+
+            token = None
+            error = None
+            if self.token is not None and self.token.refresh_token is not None:
+                payload = {
+                    'client_id':        self.client_id,
+                    'client_secret':    self.client_secret,
+                    'grant_type':       'refresh_token',
+                    'refresh_token':    self.token.refresh_token
+                }
+                try:
+                    token = await self._grant(payload)
+                except Exception as e:
+                    error = e
+            if token is None:
+                if self.mode is OsuAuthenticationMode.AUTHORIZATION_CODE and not interactive:
+                    self.retry_at = time() + RETRY_INTERVAL
+                    raise AuthorizationError("Could not refresh the osu! token, "
+                                             "restart to authorize again") from error
+                token = await self._acquire()
+
+            self.token = token
+            self.save()
+            if self.on_refresh is not None:
+                self.on_refresh(token)
+
+    async def _acquire(self):
+        payload = {
+            'client_id':        self.client_id,
+            'client_secret':    self.client_secret,
+            'grant_type':       'client_credentials',
+            'scope':            'public',
+        }
+
+        if self.mode is OsuAuthenticationMode.AUTHORIZATION_CODE:
+            params = {
+                'client_id':        self.client_id,
+                'scope':            'public',
+                'response_type':    'code',
+                'redirect_uri':     REDIRECT_URI
+            }
+            webbrowser.open(f'{self.oauth_url}/authorize?{urlencode(params)}')
+            code = await asyncio.to_thread(get_code)
+            payload = {
+                'client_id':        self.client_id,
+                'client_secret':    self.client_secret,
+                'grant_type':       'authorization_code',
+                'code':             code,
+                'redirect_uri':     REDIRECT_URI
+            }
+
+        return await self._grant(payload)
+
+    async def _grant(self, payload):
+        async with self.session.post(f'{self.oauth_url}/token', data=payload) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        return Token.from_response(data)
+
+
+def get_code():
+    code = None
+    running = True
+
+    class Server(BaseHTTPRequestHandler):
+        def do_GET(self):
+            nonlocal code, running
+
+            response = b'<body onload="window.close()" />'
+            self.send_response(200)
+            self.send_header("Content-type", "text/html")
+            self.send_header("Content-length", len(response))
+            self.end_headers()
+            self.wfile.write(response)
+
+            components = urlparse(self.path)
+            values = parse_qs(components.query)
+            code = values['code'][0]
+            running = False
+
+        def log_message(self, *args):
+            return
+
+    server = HTTPServer(('localhost', REDIRECT_PORT), Server)
+    while running:
+        server.handle_request()
+    server.server_close()
+
+    return code
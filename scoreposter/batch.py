@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import csv
+import json
+from pathlib import Path
+
+import tracing
+import utils
+from colors import color
+from post import PostOptions
+from replays import ReplayIndex
+from score import Score
+from workers import AnalysisPool
+
+FIELDS = ['replay', 'player', 'beatmap_id', 'artist', 'title', 'difficulty', 'mods',
+          'accuracy', 'rank', 'combo', 'max_combo', 'misses', 'sliderbreaks', 'stars',
+          'ur', 'pp', 'fcpp']
+ONLINE_FIELDS = ['ranked', 'loved', 'ranking', 'post_title']
+
+
+class JSONLWriter:
+
+    def __init__(self, path, fields):
+        self.path = Path(path)
+        self.fields = fields
+        self.file = None
+
+    def completed(self):
+        if not self.path.exists():
+            return set()
+
+        done = set()
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    done.add(json.loads(line)['replay'])
+                except (json.JSONDecodeError, KeyError):
+                    continue
+        return done
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+    def write(self, record):
+        self.file.write(json.dumps({field: record[field] for field in self.fields}) + '\n')
+        self.file.flush()
+
+
+class CSVWriter(JSONLWriter):
+
+    def completed(self):
+        if not self.path.exists():
+            return set()
+
+        with open(self.path, newline='') as file:
+            return {row['replay'] for row in csv.DictReader(file) if row.get('replay')}
+
+    def __enter__(self):
+        is_new = not self.path.exists() or self.path.stat().st_size == 0
+        self.file = open(self.path, 'a', newline='')
+        self.writer = csv.DictWriter(self.file, self.fields, extrasaction='ignore')
+        if is_new:
+            self.writer.writeheader()
+        return self
+
+    def write(self, record):
+        self.writer.writerow(record)
+        self.file.flush()
+
+
+def to_record(score, options):
+    record = {
+        'replay':       Path(score.replay_path).name,
+        'player':       score.player,
+        'beatmap_id':   score.beatmap_id,
+        'artist':       score.artist,
+        'title':        score.title,
+        'difficulty':   score.difficulty,
+        'mods':         score.mod_string(),
+        'accuracy':     score.accuracy,
+        'rank':         score.rank.name,
+        'combo':        score.combo,
+        'max_combo':    score.max_combo,
+        'misses':       score.misses,
+        'sliderbreaks': score.sliderbreaks,
+        'stars':        score.stars,
+        'ur':           score.ur,
+        'pp':           score.pp,
+        'fcpp':         score.fcpp
+    }
+    if score.osu_api is not None:
+        record['ranked'] = score.ranked
+        record['loved'] = score.loved
+        record['ranking'] = score.ranking
+        record['post_title'] = score.construct_title(options)
+    return record
+
+
+async def analyze_replays(paths, writer, pool, osu_api=None):
+    options = PostOptions()
+    limit = asyncio.Semaphore(pool.queue_size)
+
+    async def analyze(path):
+        async with limit:
+            try:
+                score = await Score.from_replay(path, osu_api, pool)
+                writer.write(to_record(score, options))
+            except Exception as e:
+                print(color(f"Failed to analyze {path.name}: {e}", fg='red'))
+
+    await asyncio.gather(*(analyze(path) for path in paths))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', nargs='?', type=Path, default=utils.OSU_PATH / 'Replays')
+    parser.add_argument('-o', '--output', type=Path, default=Path('output/replays.jsonl'))
+    parser.add_argument('-w', '--workers', type=int)
+    parser.add_argument('--online', action='store_true')
+    parser.add_argument('-p', '--player', type=str)
+    parser.add_argument('-b', '--beatmap', type=str)
+    parser.add_argument('--trace', type=str)
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        tracing.enable(args.trace)
+
+    fields = FIELDS + ONLINE_FIELDS if args.online else FIELDS
+    writer_cls = CSVWriter if args.output.suffix == '.csv' else JSONLWriter
+    writer = writer_cls(args.output, fields)
+
+    count = utils.refresh_db()
+    print(f'Database refreshed ({count} beatmaps indexed).')
+
+    done = writer.completed()
+    index = ReplayIndex(args.directory)
+    index.update()
+    if args.player is not None:
+        replays = index.by_player(args.player)
+    elif args.beatmap is not None:
+        replays = index.by_beatmap(args.beatmap)
+    else:
+        replays = index.all()
+    replays = [replay for replay in replays if replay.path.name not in done]
+    paths = sorted(replay.path for replay in replays)
+    print(f"Analyzing {len(paths)} replays ({len(done)} already done).")
+
+    with writer:
+        async with AnalysisPool(args.workers) as pool:
+            if args.online:
+                async with utils.OsuAPI() as osu_api:
+                    await utils.get_beatmaps().fetch([replay.beatmap_hash for replay in replays], osu_api)
+                    await analyze_replays(paths, writer, pool, osu_api)
+            else:
+                await analyze_replays(paths, writer, pool)
+    print(color("Analysis complete!", fg='green'))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+from re import search
+
+import utils
+from downloads import DownloadCache
+
+BEATMAP_STORE_PATH = 'beatmaps.db'
+BEATMAP_DOWNLOAD_DIR = Path('output/beatmaps')
+BEATMAP_CACHE_SIZE = 256 * 2**20
+FETCH_CONCURRENCY = 8
+LOOKUP_CHUNK = 500
+BEATMAP_KIND = 'osu'
+BEATMAP_SUFFIX = '.osu'
+SONGS = 'songs'
+DOWNLOAD = 'download'
+BACKGROUND_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+COLUMNS = ['md5', 'path', 'source', 'beatmap_id', 'artist', 'title', 'difficulty', 'mapper',
+           'background', 'mtime_ns', 'size']
+
+
+class BeatmapNotFound(Exception):
+    pass
+
+
+class Beatmap:
+
+    def __init__(self, md5, path, source, beatmap_id, artist, title, difficulty, mapper,
+                 background=None, mtime_ns=None, size=None):
+        self.md5 = md5
+        self.path = Path(path)
+        self.source = source
+        self.beatmap_id = beatmap_id
+        self.artist = artist
+        self.title = title
+        self.difficulty = difficulty
+        self.mapper = mapper
+        self.background = Path(background) if background is not None else None
+        self.mtime_ns = mtime_ns
+        self.size = size
+
+    def row(self):
+        return (self.md5, str(self.path), self.source, self.beatmap_id, self.artist, self.title,
+                self.difficulty, self.mapper,
+                str(self.background) if self.background is not None else None,
+                self.mtime_ns, self.size)
+
+
+def read_beatmap(path, source=SONGS):
+    path = Path(path)
+    data = path.read_bytes()
+    metadata = {}
+    background = None
+    section = None
+    for line in data.decode('utf-8', errors='replace').splitlines():
+        line = line.strip()
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1]
+            if section in ('TimingPoints', 'HitObjects'):
+                break
+        elif section == 'Metadata' and ':' in line:
+            key, value = line.split(':', 1)
+            metadata[key.strip()] = value.strip()
+        elif section == 'Events' and background is None and \
+                any(ext in line.lower() for ext in BACKGROUND_EXTENSIONS):
+            match = search('"(.+?)"', line)
+            if match is not None:
+                background = path.parent / match.group(1)
+
+    beatmap_id = metadata.get('BeatmapID')
+    stat = path.stat()
+    return Beatmap(hashlib.md5(data).hexdigest(), path, source,
+                   int(beatmap_id) if beatmap_id and beatmap_id.lstrip('-').isdigit() else None,
+                   metadata.get('Artist'), metadata.get('Title'), metadata.get('Version'),
+                   metadata.get('Creator'), background, stat.st_mtime_ns, stat.st_size)
+
+
+class BeatmapStore:
+
+    def __init__(self, songs_dir, path=BEATMAP_STORE_PATH, download_dir=BEATMAP_DOWNLOAD_DIR,
+                 max_size=BEATMAP_CACHE_SIZE):
+        self.songs_dir = Path(songs_dir)
+        self.downloads = DownloadCache(download_dir, max_size)
+        self.pending = {}
+        self.semaphore = None
+        self.db = sqlite3.connect(path, timeout=10)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS beatmaps (
+                               md5 TEXT PRIMARY KEY,
+                               path TEXT NOT NULL,
+                               source TEXT NOT NULL,
+                               beatmap_id INTEGER,
+                               artist TEXT,
+                               title TEXT,
+                               difficulty TEXT,
+                               mapper TEXT,
+                               background TEXT,
+                               mtime_ns INTEGER,
+                               size INTEGER)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS beatmaps_path ON beatmaps (path)')
+
+    def scan(self):
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                 self.db.execute('SELECT path, mtime_ns, size FROM beatmaps WHERE source = ?', (SONGS,))}
+        seen = set()
+        rows = []
+        for directory, _, files in os.walk(self.songs_dir):
+            for name in files:
+                if not name.endswith(BEATMAP_SUFFIX):
+                    continue
+                path = os.path.join(directory, name)
+                seen.add(path)
+                try:
+                    stat = os.stat(path)
+                    if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                        continue
+                    rows.append(read_beatmap(path).row())
+                except OSError:
+                    continue
+
+        stale = [(path,) for path in known.keys() - seen]
+        stale += [(row[1],) for row in rows if row[1] in known]
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        with self.db:
+            self.db.executemany('DELETE FROM beatmaps WHERE path = ? AND source = ?',
+                                [(path, SONGS) for path, in stale])
+            self.db.executemany(f'INSERT OR REPLACE INTO beatmaps VALUES ({placeholders})', rows)
+        return len(rows)
+
+    def get_many(self, md5s, owner=None):
+        md5s = list(set(md5s))
+        beatmaps = {}
+        stale = []
+        columns = ', '.join(COLUMNS)
+        for start in range(0, len(md5s), LOOKUP_CHUNK):
+            chunk = md5s[start:start + LOOKUP_CHUNK]
+            placeholders = ', '.join('?' for _ in chunk)
+            cur = self.db.execute(f'SELECT {columns} FROM beatmaps WHERE md5 IN ({placeholders})', chunk)
+            for row in cur:
+                beatmap = Beatmap(*row)
+                if beatmap.source == DOWNLOAD and \
+                   self.downloads.get(BEATMAP_KIND, beatmap.md5, BEATMAP_SUFFIX, owner) is None:
+                    stale.append((beatmap.md5,))
+                    continue
+                beatmaps[beatmap.md5] = beatmap
+
+        if stale:
+            with self.db:
+                self.db.executemany('DELETE FROM beatmaps WHERE md5 = ?', stale)
+        return beatmaps
+
+    def get(self, md5, owner=None):
+        return self.get_many([md5], owner).get(md5)
+
+    async def _download(self, md5, osu_api, priority):
+        async with self.semaphore:
+            data = await osu_api.request('beatmaps/lookup', {'checksum': md5}, priority=priority)
+            if not isinstance(data, dict) or 'id' not in data:
+                raise BeatmapNotFound(f"Beatmap {md5} not found.")
+            url = f'{utils.osu_url()}/osu/{data["id"]}'
+            path = await self.downloads.fetch(osu_api.session, url, BEATMAP_KIND, md5, BEATMAP_SUFFIX)
+
+        beatmapset = data['beatmapset']
+        beatmap = Beatmap(md5, path, DOWNLOAD, data['id'], beatmapset['artist'],
+                          beatmapset['title'], data['version'], beatmapset['creator'])
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        with self.db:
+            self.db.execute(f'INSERT OR REPLACE INTO beatmaps VALUES ({placeholders})', beatmap.row())
+        return beatmap
+
+    def _fetch(self, md5, osu_api, priority):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+        task = self.pending.get(md5)
+        if task is None:
+            task = asyncio.create_task(self._download(md5, osu_api, priority))
+            self.pending[md5] = task
+            task.add_done_callback(lambda _: self.pending.pop(md5, None))
+        return asyncio.shield(task)
+
+    async def resolve(self, md5, osu_api=None, priority=utils.Priority.DEFAULT, owner=None):
+        await self.downloads.load()
+        beatmap = self.get(md5, owner)
+        if beatmap is not None:
+            return beatmap
+        if osu_api is None:
+            raise BeatmapNotFound(f"Beatmap {md5} is not in the Songs folder.")
+        beatmap = await self._fetch(md5, osu_api, priority)
+        if owner is not None:
+            self.downloads.pin(beatmap.path, owner)
+        return beatmap
+
+    async def fetch(self, md5s, osu_api, priority=utils.Priority.DEFAULT):
+        await self.downloads.load()
+        beatmaps = self.get_many(md5s)
+        missing = [md5 for md5 in set(md5s) if md5 not in beatmaps]
+        results = await asyncio.gather(*(self._fetch(md5, osu_api, priority) for md5 in missing),
+                                       return_exceptions=True)
+        for md5, result in zip(missing, results):
+            if isinstance(result, BaseException):
+                continue
+            beatmaps[md5] = result
+        return beatmaps
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import tempfile
+import weakref
+from collections import Counter, OrderedDict
+from pathlib import Path
+from time import perf_counter
+
+import aiofiles
+import metrics
+from transport import check_status, retry
+
+DOWNLOAD_DIR = Path('output/cache')
+DOWNLOAD_CACHE_SIZE = 512 * 2**20
+CHUNK_SIZE = 64 * 2**10
+PARTIAL_SUFFIX = '.part'
+
+
+def write_file(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, partial = tempfile.mkstemp(dir=path.parent, suffix=PARTIAL_SUFFIX)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(partial, path)
+    except BaseException:
+        Path(partial).unlink(missing_ok=True)
+        raise
+
+
+class DownloadCache:
+
+    def __init__(self, directory=DOWNLOAD_DIR, max_size=DOWNLOAD_CACHE_SIZE):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.entries = None
+        self.pending = {}
+        self.pins = Counter()
+        self.loading = None
+
+    def _scan(self):
+        entries = OrderedDict()
+        if not self.directory.exists():
+            return entries
+
+        files = []
+        for path in self.directory.rglob('*'):
+            if not path.is_file():
+                continue
+            if path.suffix == PARTIAL_SUFFIX:
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            entries[path] = size
+        return entries
+
+    def _load(self):
+        self.entries = self._scan()
+
+    async def load(self):
+        if self.entries is not None:
+            return
+        if self.loading is None:
+            self.loading = asyncio.create_task(asyncio.to_thread(self._scan))
+        entries = await asyncio.shield(self.loading)
+        if self.entries is None:
+            self.entries = entries
+
+    def pin(self, path, owner=None):
+        self.pins[path] += 1
+        if owner is not None:
+            weakref.finalize(owner, self.release, path)
+
+    def release(self, path):
+        self.pins[path] -= 1
+        if self.pins[path] <= 0:
+            del self.pins[path]
+
+    def path(self, kind, key, suffix):
+        return self.directory / kind / f'{key}{suffix}'
+
+    def get(self, kind, key, suffix, owner=None):
+        if self.entries is None:
+            self._load()
+
+        path = self.path(kind, key, suffix)
+        if path not in self.entries:
+            return None
+        if not path.exists():
+            del self.entries[path]
+            return None
+
+        self.entries.move_to_end(path)
+        os.utime(path)
+        if owner is not None:
+            self.pin(path, owner)
+        return path
+
+    async def fetch(self, session, url, kind, key, suffix, headers=None, before=None, owner=None):
+        await self.load()
+        path = self.get(kind, key, suffix, owner)
+        if path is not None:
+            metrics.CACHE_LOOKUPS.inc(cache='downloads', result='hit')
+            return path
+
+        task = self.pending.get(path := self.path(kind, key, suffix))
+        if task is None:
+            metrics.CACHE_LOOKUPS.inc(cache='downloads', result='miss')
+            task = asyncio.create_task(self._download(session, url, path, headers, before))
+            self.pending[path] = task
+            task.add_done_callback(lambda _: self.pending.pop(path, None))
+        else:
+            metrics.CACHE_LOOKUPS.inc(cache='downloads', result='shared')
+        path = await asyncio.shield(task)
+        if owner is not None:
+            self.pin(path, owner)
+        return path
+
+    async def _download(self, session, url, path, headers, before):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=path.parent, suffix=PARTIAL_SUFFIX)
+        os.close(fd)
+        label = f'download/{path.parent.name}'
+
+        async def download():
+            start = perf_counter()
+            try:
+                async with session.get(url, headers=headers() if callable(headers) else headers) \
+                        as response:
+                    metrics.REQUESTS.inc(endpoint=label, status=response.status)
+                    check_status(response)
+                    response.raise_for_status()
+                    async with aiofiles.open(partial, 'wb') as file:
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            await file.write(chunk)
+            except Exception as e:
+                metrics.REQUEST_ERRORS.inc(endpoint=label, error=type(e).__name__)
+                raise
+            finally:
+                metrics.REQUEST_LATENCY.observe(perf_counter() - start, endpoint=label)
+
+        try:
+            await retry(download, before)
+            os.replace(partial, path)
+        except BaseException:
+            Path(partial).unlink(missing_ok=True)
+            raise
+
+        self.add(path)
+        return path
+
+    async def store(self, kind, key, suffix, data):
+        await self.load()
+        path = self.path(kind, key, suffix)
+        await asyncio.to_thread(write_file, path, data)
+        self.add(path)
+        return path
+
+    def add(self, path):
+        self.entries[path] = path.stat().st_size
+        self.entries.move_to_end(path)
+        self.evict()
+
+    def evict(self):
+        total = sum(self.entries.values())
+        for path in list(self.entries)[:-1]:
+            if total <= self.max_size:
+                break
+            if path in self.pins:
+                continue
+            size = self.entries.pop(path)
+            path.unlink(missing_ok=True)
+            total -= size
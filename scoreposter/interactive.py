@@ -3,75 +3,177 @@
 import argparse
 import asyncio
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
 
 import pyperclip
+import tracing
 import utils
 from colors import color
-from post import Post, PostOptions
+from post import Post, PostOptions, Prerender
 from score import Score
+from uploader import Uploader
+from watcher import ReplayWatcher, latest_replay
 
+PREFETCH = 2
 
-async def run_interactive_mode(options, osu_api, replay_path=None, submission=None):
+
+async def ainput(prompt):
+    return await asyncio.to_thread(input, prompt)
+
+
+async def load_score(osu_api, replay_path=None, submission=None, score_id=None, pool=None):
     if replay_path is not None:
-        score = await Score.from_replay(replay_path, osu_api)
-    else:
-        score = await Score.from_submission(submission, osu_api)
+        return await Score.from_replay(replay_path, osu_api, pool)
+    if submission is None:
+        submission = await osu_api.request(f'scores/osu/{score_id}')
+    return await Score.from_submission(submission, osu_api, pool)
+
+
+async def run_interactive_mode(options, osu_api, replay_path=None, submission=None, pool=None):
+    score = await load_score(osu_api, replay_path, submission, pool=pool)
+    async with Uploader(1) as uploader:
+        await edit_score(score, options, uploader)
+
 
+async def edit_score(score, options, uploader):
     post = Post(score, options)
     print(title := post.title)
 
-    actions = ['p', 'm', 'o', 's', 'c', 'b', 'q']
-    action_text = "/".join(actions)
-    action = ''
-    while action != 'q':
+    with ThreadPoolExecutor(1, thread_name_prefix='prerender') as executor:
+        prerender = Prerender(post, executor)
+        prerender.start()
+
+        actions = ['p', 'm', 'o', 's', 'c', 'b', 'q']
+        action_text = "/".join(actions)
         action = ''
-        while action not in actions:
-            action = input(f"Action ({action_text}): ").lower()
-
-        if action == 'p':
-            post.submit()
-            print(color("Post submitted!", fg='green'))
-        elif action == 'm':
-            message = input("Message: ")
-            if message == '':
-                message = None
-            options.message = message
-            print(title := post.title)
-        elif action == 'o':
-            to_toggle = input("Options (p/f/c/u/m): ")
-            if 'p' in to_toggle:
-                options.show_pp = not options.show_pp
-            if 'f' in to_toggle:
-                options.show_fc_pp = not options.show_fc_pp
-            if 'c' in to_toggle:
-                if options.show_combo is None:
-                    options.show_combo = score.fc
-                else:
-                    options.show_combo = not options.show_combo
-            if 'u' in to_toggle:
-                options.show_ur = not options.show_ur
-            if 'm' in to_toggle:
-                options.show_mapper = not options.show_mapper
-            print(title := post.title)
-        elif action == 's':
+        while action != 'q':
+            action = ''
+            while action not in actions:
+                action = (await ainput(f"Action ({action_text}): ")).lower()
+
+            if action == 'p':
+                try:
+                    image = await prerender.image()
+                    url = await uploader.upload(title, image)
+                except Exception:
+                    import traceback
+                    traceback.print_exc()
+                    print(color("Post failed.", fg='red'))
+                    continue
+                print(color("Post submitted!", fg='green'))
+                print(url)
+            elif action == 'm':
+                message = await ainput("Message: ")
+                if message == '':
+                    message = None
+                options.message = message
+                print(title := post.title)
+            elif action == 'o':
+                to_toggle = await ainput("Options (p/f/c/u/m): ")
+                if 'p' in to_toggle:
+                    options.show_pp = not options.show_pp
+                if 'f' in to_toggle:
+                    options.show_fc_pp = not options.show_fc_pp
+                if 'c' in to_toggle:
+                    if options.show_combo is None:
+                        options.show_combo = score.fc
+                    else:
+                        options.show_combo = not options.show_combo
+                if 'u' in to_toggle:
+                    options.show_ur = not options.show_ur
+                if 'm' in to_toggle:
+                    options.show_mapper = not options.show_mapper
+                prerender.start()
+                print(title := post.title)
+            elif action == 's':
+                try:
+                    sliderbreaks = int(await ainput("Sliderbreaks: "))
+                except ValueError:
+                    continue
+                prerender.cancel()
+                score.sliderbreaks = sliderbreaks
+                score.calculate_statistics()
+                prerender.start()
+                print(title := post.title)
+            elif action == 'c':
+                pyperclip.copy(title)
+                print(color("Title copied to clipboard!", fg='green'))
+            elif action == 'b':
+                webbrowser.open(score.beatmap['url'])
+
+        prerender.cancel()
+
+
+class Session:
+
+    def __init__(self, osu_api, options, pool=None, prefetch=PREFETCH):
+        self.osu_api = osu_api
+        self.options = options
+        self.pool = pool
+        self.pending = asyncio.Queue()
+        self.ready = asyncio.Queue(max(1, prefetch))
+        self.uploader = Uploader(1)
+
+    async def __aenter__(self):
+        await self.uploader.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.uploader.__aexit__(*args)
+
+    def add(self, replay_path=None, submission=None, score_id=None):
+        self.pending.put_nowait((replay_path, submission, score_id))
+
+    def close(self):
+        self.pending.put_nowait(None)
+
+    async def prefetch(self):
+        while (item := await self.pending.get()) is not None:
             try:
-                sliderbreaks = int(input("Sliderbreaks: "))
-            except ValueError:
+                score = await load_score(self.osu_api, *item, pool=self.pool)
+            except Exception:
+                import traceback
+                traceback.print_exc()
                 continue
-            score.sliderbreaks = sliderbreaks
-            score.calculate_statistics()
-            print(title := post.title)
-        elif action == 'c':
-            pyperclip.copy(title)
-            print(color("Title copied to clipboard!", fg='green'))
-        elif action == 'b':
-            webbrowser.open(score.beatmap['url'])
+            await self.ready.put(score)
+        await self.ready.put(None)
+
+    async def run(self):
+        prefetcher = asyncio.create_task(self.prefetch())
+        try:
+            while True:
+                if self.ready.empty() and not self.pending.empty():
+                    print("Loading next score...")
+                score = await self.ready.get()
+                if score is None:
+                    break
+                await edit_score(score, copy(self.options), self.uploader)
+        finally:
+            prefetcher.cancel()
+
+
+def read_queue(path):
+    items = []
+    with open(path) as queue:
+        for line in queue:
+            line = line.strip()
+            if line == '':
+                continue
+            if line.isdigit():
+                items.append((None, int(line)))
+            else:
+                items.append((line, None))
+    return items
 
 
 async def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('replay', nargs='?', default=None)
-    parser.add_argument('-i', '--score-id', default=None, type=int)
+    parser.add_argument('replays', nargs='*')
+    parser.add_argument('-i', '--score-id', dest='score_ids', action='append',
+                        default=[], type=int)
+    parser.add_argument('-l', '--list', type=str)
+    parser.add_argument('-n', '--prefetch', type=int, default=PREFETCH)
     parser.add_argument('-p', '--no-pp', dest='show_pp',
                         action='store_false')
     parser.add_argument('-f', '--no-fc-pp', dest='show_fc_pp',
@@ -83,11 +185,16 @@ async def main():
     parser.add_argument('-m', '--message', type=str)
     parser.add_argument('-r', '--refresh-db', dest='refresh',
                         action='store_true')
+    parser.add_argument('-w', '--watch', action='store_true')
+    parser.add_argument('--trace', type=str)
     args = parser.parse_args()
 
+    if args.trace is not None:
+        tracing.enable(args.trace)
+
     if args.refresh:
-        utils.refresh_db()
-        print('Database refreshed.')
+        count = utils.refresh_db()
+        print(f'Database refreshed ({count} beatmaps indexed).')
         exit()
 
     options = PostOptions(
@@ -98,18 +205,40 @@ async def main():
         message=args.message
     )
 
-    if not args.score_id:
-        replay_path = args.replay
-        if replay_path is None:
-            replays = (utils.OSU_PATH / 'Replays').glob('*.osr')
-            replay_path = max(replays, key=lambda path: path.stat().st_mtime)
+    if args.watch:
+        async with utils.OsuAPI() as osu_api, \
+                   Session(osu_api, options, prefetch=args.prefetch) as session:
+            print("Awaiting replays.")
+
+            async def feed():
+                async for replay_path in ReplayWatcher(utils.OSU_PATH / 'Replays'):
+                    print("Replay found!")
+                    session.add(replay_path=replay_path)
+
+            watcher = asyncio.create_task(feed())
+            try:
+                await session.run()
+            finally:
+                watcher.cancel()
+        return
+
+    items = [(replay_path, None) for replay_path in args.replays]
+    items += [(None, score_id) for score_id in args.score_ids]
+    if args.list is not None:
+        items += read_queue(args.list)
+    if not items:
+        items = [(latest_replay(utils.OSU_PATH / 'Replays'), None)]
 
-        async with utils.OsuAPI() as osu_api:
-            await run_interactive_mode(options, osu_api, replay_path=replay_path)
+    if any(score_id is not None for _, score_id in items):
+        mode = utils.OsuAuthenticationMode.AUTHORIZATION_CODE
     else:
-        async with utils.OsuAPI(mode=utils.OsuAuthenticationMode.AUTHORIZATION_CODE) as osu_api:
-            submission = await osu_api.request(f'scores/osu/{args.score_id}')
-            await run_interactive_mode(options, osu_api, submission=submission)
+        mode = utils.OsuAuthenticationMode.CLIENT_CREDENTIALS
+    async with utils.OsuAPI(mode=mode) as osu_api, \
+               Session(osu_api, options, prefetch=args.prefetch) as session:
+        for replay_path, score_id in items:
+            session.add(replay_path=replay_path, score_id=score_id)
+        session.close()
+        await session.run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import time
+
+import metrics
+import tracing
+from post import Post, PostOptions
+from score import Score
+from snapshot import ScoreSnapshot
+
+JOBS_PATH = 'jobs.db'
+RENDER_DIR = Path('output/renders')
+MAX_ATTEMPTS = 3
+
+ANALYSIS = 'analysis'
+RENDER = 'render'
+POST = 'post'
+DONE = 'done'
+STAGES = [ANALYSIS, RENDER, POST]
+
+PENDING = 'pending'
+RUNNING = 'running'
+FAILED = 'failed'
+
+
+class Job:
+
+    def __init__(self, score_id, user_id, submission, detected, title=None, snapshot=None, image=None):
+        self.score_id = score_id
+        self.user_id = user_id
+        self.submission = submission
+        self.detected = detected
+        self.title = title
+        self.snapshot = snapshot
+        self.image = image
+
+
+class JobQueue:
+
+    def __init__(self, osu_api, uploader, pool=None, path=JOBS_PATH, analysis_workers=2,
+                 render_workers=1, options=None, renderer=None):
+        self.osu_api = osu_api
+        self.uploader = uploader
+        self.renderer = renderer
+        self.pool = pool
+        self.options = options or PostOptions(show_combo=False)
+        self.workers = {ANALYSIS: analysis_workers, RENDER: render_workers, POST: uploader.workers}
+        self.render_executor = ThreadPoolExecutor(render_workers)
+        self.events = {stage: asyncio.Event() for stage in STAGES}
+        self.backgrounds = {}
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                               score_id INTEGER PRIMARY KEY,
+                               user_id INTEGER NOT NULL,
+                               submission TEXT NOT NULL,
+                               stage TEXT NOT NULL,
+                               state TEXT NOT NULL,
+                               attempts INTEGER NOT NULL DEFAULT 0,
+                               detected REAL NOT NULL,
+                               updated REAL NOT NULL,
+                               title TEXT,
+                               snapshot BLOB,
+                               image TEXT,
+                               url TEXT,
+                               error TEXT)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage, state, detected)')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS cursors (
+                               user_id INTEGER PRIMARY KEY,
+                               play TEXT NOT NULL)''')
+
+    def recover(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.execute('UPDATE jobs SET state = ? WHERE stage IN (?, ?) AND state = ?',
+                            (PENDING, ANALYSIS, RENDER, RUNNING))
+            self.db.execute('UPDATE jobs SET stage = ? WHERE stage = ? AND snapshot IS NULL AND state != ?',
+                            (ANALYSIS, RENDER, FAILED))
+            self.db.execute('UPDATE jobs SET state = ?, error = ? WHERE stage = ? AND state = ?',
+                            (FAILED, 'interrupted while posting', POST, RUNNING))
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def cursor(self, user_id):
+        row = self.db.execute('SELECT play FROM cursors WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def checkpoint(self, user_id, play):
+        self.db.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', (user_id, json.dumps(play)))
+
+    def enqueue(self, play, detected=None, cursor=None):
+        if detected is None:
+            detected = time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            cur = self.db.execute('INSERT OR IGNORE INTO jobs (score_id, user_id, submission, stage, state, '
+                                  'detected, updated) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  (play['id'], play['user_id'], json.dumps(play), ANALYSIS, PENDING,
+                                   detected, time()))
+            if cursor is not None:
+                self.checkpoint(*cursor)
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        if cur.rowcount == 0:
+            return False
+        self.events[ANALYSIS].set()
+        return True
+
+    def claim(self, stage):
+        row = self.db.execute('SELECT score_id, user_id, submission, detected, title, snapshot, image FROM jobs '
+                              'WHERE stage = ? AND state = ? ORDER BY detected LIMIT 1',
+                              (stage, PENDING)).fetchone()
+        if row is None:
+            return None
+        score_id, user_id, submission, detected, title, snapshot, image = row
+        self.db.execute('UPDATE jobs SET state = ?, updated = ? WHERE score_id = ?',
+                        (RUNNING, time(), score_id))
+        return Job(score_id, user_id, json.loads(submission), detected, title, snapshot, image)
+
+    def advance(self, job, stage, **fields):
+        assignments = ''.join(f', {field} = ?' for field in fields)
+        state = DONE if stage == DONE else PENDING
+        self.db.execute(f'UPDATE jobs SET stage = ?, state = ?, updated = ?{assignments} WHERE score_id = ?',
+                        (stage, state, time(), *fields.values(), job.score_id))
+        if stage in self.events:
+            self.events[stage].set()
+
+    def fail(self, job, stage, error):
+        attempts, = self.db.execute('SELECT attempts FROM jobs WHERE score_id = ?',
+                                    (job.score_id,)).fetchone()
+        attempts += 1
+        retry = stage != POST and attempts < MAX_ATTEMPTS
+        state = PENDING if retry else FAILED
+        self.db.execute('UPDATE jobs SET state = ?, attempts = ?, error = ?, updated = ? WHERE score_id = ?',
+                        (state, attempts, error, time(), job.score_id))
+        if retry:
+            self.events[stage].set()
+        return retry
+
+    def pin(self, score_id, bg_path):
+        if bg_path is None or score_id in self.backgrounds:
+            return
+        self.backgrounds[score_id] = Path(bg_path)
+        self.osu_api.downloads.pin(self.backgrounds[score_id])
+
+    def unpin(self, score_id):
+        path = self.backgrounds.pop(score_id, None)
+        if path is not None:
+            self.osu_api.downloads.release(path)
+
+    def backlog(self):
+        cur = self.db.execute('SELECT stage, COUNT(*) FROM jobs WHERE state != ? GROUP BY stage', (FAILED,))
+        counts = dict(cur)
+        return {stage: counts.get(stage, 0) for stage in STAGES}
+
+    async def analyze(self, job):
+        score = await Score.from_submission(job.submission, self.osu_api, self.pool)
+        snapshot = ScoreSnapshot.from_score(score)
+        title = Post(snapshot, self.options).title
+        self.pin(job.score_id, snapshot.bg_path)
+        self.advance(job, RENDER, title=title, snapshot=snapshot.to_bytes())
+
+    async def render(self, job):
+        if job.snapshot is None:
+            self.advance(job, ANALYSIS)
+            return
+        score = ScoreSnapshot.from_bytes(job.snapshot)
+        RENDER_DIR.mkdir(parents=True, exist_ok=True)
+        image = RENDER_DIR / f'{job.score_id}.png'
+        self.pin(job.score_id, score.bg_path)
+        try:
+            if self.renderer is not None:
+                encoded = await self.renderer.render(score, self.options)
+                await asyncio.to_thread(image.write_bytes, encoded)
+            else:
+                from results import render_results
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self.render_executor,
+                                           tracing.bind(render_results, score, self.options, image))
+        finally:
+            self.unpin(job.score_id)
+        self.advance(job, POST, image=str(image))
+
+    async def post(self, job):
+        image = await asyncio.to_thread(Path(job.image).read_bytes)
+        url = await self.uploader.upload(job.title, image)
+        self.advance(job, DONE, url=url)
+        metrics.POST_LATENCY.observe(time() - job.detected)
+        print(job.title)
+        print(url)
+
+    async def worker(self, stage):
+        handler = {ANALYSIS: self.analyze, RENDER: self.render, POST: self.post}[stage]
+        while True:
+            self.events[stage].clear()
+            job = self.claim(stage)
+            if job is None:
+                await self.events[stage].wait()
+                continue
+
+            try:
+                with tracing.span(f'job {stage}', score_id=job.score_id):
+                    await handler(job)
+
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                self.fail(job, stage, repr(e))
+
+    async def run(self):
+        self.recover()
+        workers = [self.worker(stage) for stage in STAGES for _ in range(self.workers[stage])]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            self.render_executor.shutdown(wait=False)
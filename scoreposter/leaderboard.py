@@ -0,0 +1,80 @@
+import asyncio
+from time import time
+
+import metrics
+from ratelimit import Priority
+
+LEADERBOARD_TTL = 30
+
+
+class Leaderboard:
+
+    def __init__(self, scores, fetched=None):
+        self.scores = scores
+        self.fetched = time() if fetched is None else fetched
+        self.ranks = {}
+        for rank, score in enumerate(scores, start=1):
+            self.ranks.setdefault(score['user_id'], rank)
+
+    def find(self, user_id):
+        rank = self.ranks.get(user_id)
+        if rank is None:
+            return None, None
+        return rank, self.scores[rank - 1]
+
+
+class LeaderboardCache:
+
+    def __init__(self, osu_api, ttl=LEADERBOARD_TTL):
+        self.osu_api = osu_api
+        self.ttl = ttl
+        self.entries = {}
+        self.pending = {}
+
+    @staticmethod
+    def key(beatmap_id, mods=None):
+        return beatmap_id, frozenset(mods) if mods else None
+
+    def _prune(self):
+        now = time()
+        expired = [key for key, leaderboard in self.entries.items()
+                   if now - leaderboard.fetched > self.ttl]
+        for key in expired:
+            del self.entries[key]
+
+    async def get(self, beatmap_id, mods=None, since=None):
+        key = self.key(beatmap_id, mods)
+        leaderboard = self.entries.get(key)
+        if leaderboard is not None and time() - leaderboard.fetched <= self.ttl and \
+           (since is None or leaderboard.fetched >= since):
+            metrics.CACHE_LOOKUPS.inc(cache='leaderboards', result='hit')
+            return leaderboard
+
+        task = self.pending.get(key)
+        if task is None:
+            metrics.CACHE_LOOKUPS.inc(cache='leaderboards', result='miss')
+            task = asyncio.create_task(self._fetch(key))
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        else:
+            metrics.CACHE_LOOKUPS.inc(cache='leaderboards', result='shared')
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key):
+        beatmap_id, mods = key
+        parameters = []
+        if mods:
+            parameters = [('mods[]', mod) for mod in sorted(mods)]
+        fetched = time()
+        data = await self.osu_api.request(f'beatmaps/{beatmap_id}/scores', parameters,
+                                          priority=Priority.POST)
+        if not isinstance(data, dict) or 'scores' not in data:
+            return None
+
+        self._prune()
+        leaderboard = Leaderboard(data['scores'], fetched)
+        self.entries[key] = leaderboard
+        return leaderboard
+
+    def invalidate(self, beatmap_id, mods=None):
+        self.entries.pop(self.key(beatmap_id, mods), None)
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from time import time
+
+import utils
+from aiohttp import web
+from jobs import DONE, FAILED, JobQueue
+from standin import DEFAULT_PORT, Fixtures, StandInServer
+from tracker import POLL_BUDGET, RECENT_LIMIT, Tracker
+from uploader import UPLOAD_WORKERS, Uploader
+from workers import AnalysisPool
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+RECENT_FIXTURE = Path('api/v2/users/_/scores/recent.json')
+USERS_FIXTURE = Path('api/v2/users.json')
+STANDIN_CREDENTIAL = 'standin'
+FIRST_USER_ID = 1000001
+PLAYERS = 20
+PLAYS = 5
+DURATION = 120
+PLAY_INTERVAL = 10
+
+
+def generate_fixtures(directory, players, plays, interval):
+    shutil.copytree(FIXTURES_DIR, directory)
+    template = json.loads((directory / RECENT_FIXTURE).read_text())
+    if isinstance(template, dict):
+        template = template['__sequence__'][-1]
+    template = template[0]
+
+    start = datetime.now(timezone.utc)
+    users = []
+    for index in range(players):
+        user_id = FIRST_USER_ID + index
+        user = {**template['user'], 'id': user_id, 'username': f'standin{index}'}
+        history = []
+        sequence = []
+        for number in range(plays + 1):
+            score_id = user_id * 1000 + number
+            created_at = start + timedelta(seconds=interval * number)
+            history.insert(0, {**template, 'id': score_id, 'best_id': score_id, 'user_id': user_id,
+                               'user': user, 'created_at': created_at.isoformat()})
+            sequence.append(history[:RECENT_LIMIT])
+
+        fixture = directory / 'api/v2/users' / str(user_id) / 'scores/recent.json'
+        fixture.parent.mkdir(parents=True)
+        fixture.write_text(json.dumps({'__sequence__': sequence}))
+        users.append({'id': user_id, 'username': user['username'], 'is_online': True,
+                      'last_visit': None})
+    (directory / USERS_FIXTURE).write_text(json.dumps({'users': users}))
+    return [user['id'] for user in users]
+
+
+def prepare(players, plays, interval, port):
+    Path('output').mkdir(exist_ok=True)
+    work = Path(tempfile.mkdtemp(prefix='loadtest-', dir='output')).resolve()
+    user_ids = generate_fixtures(work / 'fixtures', players, plays, interval)
+    (work / 'Songs').mkdir()
+    url = f'http://localhost:{port}'
+    (work / utils.CONFIG_PATH).write_text(json.dumps({
+        'osu_path':     str(work),
+        'beatmaps_dir': str(work / 'Songs'),
+        'osu_url':      url,
+        'reddit_url':   url
+    }))
+    keys = ['osu_key', 'osu_id', 'osu_secret', 'reddit_id', 'reddit_secret', 'username', 'password']
+    (work / utils.KEYS_PATH).write_text(json.dumps({key: STANDIN_CREDENTIAL for key in keys}))
+    return work, user_ids
+
+
+def report(jobs, server, elapsed, expected):
+    cur = jobs.db.execute('SELECT updated - detected FROM jobs WHERE stage = ?', (DONE,))
+    latencies = sorted(latency for latency, in cur)
+    failed, = jobs.db.execute('SELECT COUNT(*) FROM jobs WHERE state = ?', (FAILED,)).fetchone()
+    print(f"Posted {len(latencies)}/{expected} plays in {elapsed:.0f}s "
+          f"({len(latencies) / elapsed * 60:.1f} per minute), {failed} failed")
+    if latencies:
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        print(f"Detection to post: median {statistics.median(latencies):.2f}s, "
+              f"p95 {p95:.2f}s, max {latencies[-1]:.2f}s")
+    backlog = ", ".join(f"{stage}: {count}" for stage, count in jobs.backlog().items())
+    print(f"Job queue: {backlog}")
+    print(f"Stand-in: {server.counts['requests']} requests, {server.counts['rate_limited']} rate limited, "
+          f"{server.counts['errors']} errors, {server.submissions} submissions")
+
+
+async def load_test(args):
+    work, user_ids = prepare(args.players, args.plays, args.interval, args.port)
+    os.chdir(work)
+    print(f"Load testing {len(user_ids)} players in {work}")
+
+    server = StandInServer(Fixtures(work / 'fixtures'), args.latency, args.jitter,
+                           args.rate_limit, args.error_rate)
+    runner = web.AppRunner(server.application())
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', args.port).start()
+    try:
+        async with utils.OsuAPI(STANDIN_CREDENTIAL, STANDIN_CREDENTIAL, STANDIN_CREDENTIAL) as osu_api, \
+                   AnalysisPool(args.workers) as pool, \
+                   Uploader(args.post_workers) as uploader:
+            jobs = JobQueue(osu_api, uploader, pool)
+            start = time()
+            Tracker(user_ids, osu_api, pool, args.budget, jobs)
+            await asyncio.sleep(args.duration)
+            report(jobs, server, time() - start, len(user_ids) * args.plays)
+
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--players', type=int, default=PLAYERS)
+    parser.add_argument('-p', '--plays', type=int, default=PLAYS)
+    parser.add_argument('-d', '--duration', type=float, default=DURATION)
+    parser.add_argument('-i', '--interval', type=float, default=PLAY_INTERVAL)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-w', '--workers', type=int)
+    parser.add_argument('--post-workers', type=int, default=UPLOAD_WORKERS)
+    parser.add_argument('-b', '--budget', type=int, default=POLL_BUDGET)
+    parser.add_argument('-l', '--latency', type=float, default=0)
+    parser.add_argument('-j', '--jitter', type=float, default=0)
+    parser.add_argument('-r', '--rate-limit', type=int)
+    parser.add_argument('-e', '--error-rate', type=float, default=0)
+    args = parser.parse_args()
+    asyncio.run(load_test(args))
+
+
+if __name__ == '__main__':
+    main()
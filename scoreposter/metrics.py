@@ -0,0 +1,161 @@
+import re
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+POST_BUCKETS = (1, 2.5, 5, 10, 15, 30, 60, 120, 300, 600)
+DEFAULT_PORT = 9270
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+
+def endpoint_label(endpoint):
+    return re.sub(r'(?<![^/])\d+(?![^/])', ':id', endpoint)
+
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+    def key(self, labels):
+        return tuple((label, labels[label]) for label in self.labels)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.description}',
+                f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        super().__init__(name, description, labels)
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        self.values[self.key(labels)] += amount
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{format_labels(key)} {format_value(value)}')
+        return lines
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def __init__(self, name, description, func=None):
+        super().__init__(name, description)
+        self.func = func
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        value = self.func() if self.func is not None else self.value
+        return self.header() + [f'{self.name} {format_value(value or 0)}']
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        self.counts = {}
+        self.sums = defaultdict(float)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        self.sums[key] += value
+
+    def render(self):
+        lines = self.header()
+        for key, counts in sorted(self.counts.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = format_labels(key + (('le', format_value(bound)),))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            lines.append(f'{self.name}_bucket{format_labels(key + (("le", "+Inf"),))} {counts[-1]}')
+            lines.append(f'{self.name}_sum{format_labels(key)} {format_value(self.sums[key])}')
+            lines.append(f'{self.name}_count{format_labels(key)} {counts[-1]}')
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.register(Counter(
+    'osu_api_requests_total', 'osu! API responses by endpoint and status code.',
+    ('endpoint', 'status')))
+REQUEST_ERRORS = REGISTRY.register(Counter(
+    'osu_api_errors_total', 'Failed osu! API request attempts by endpoint and error.',
+    ('endpoint', 'error')))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'osu_api_request_seconds', 'osu! API request attempt latency.', ('endpoint',)))
+RATE_LIMIT_WAIT = REGISTRY.register(Histogram(
+    'osu_api_rate_limit_wait_seconds', 'Time spent waiting in ensure_rate_limit.', ('priority',)))
+API_RATE = REGISTRY.register(Gauge(
+    'osu_api_rate_per_minute', 'osu! API requests made in the last minute by all processes.'))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'scoreposter_cache_lookups_total', 'Cache lookups by cache and result.', ('cache', 'result')))
+DETECTION_LATENCY = REGISTRY.register(Histogram(
+    'tracker_play_to_detection_seconds', 'Time from a play being set to the tracker seeing it.',
+    buckets=POST_BUCKETS))
+POST_LATENCY = REGISTRY.register(Histogram(
+    'tracker_detection_to_post_seconds', 'Time from detecting a play to submitting its post.',
+    buckets=POST_BUCKETS))
+
+
+async def handle_metrics(request):
+    from aiohttp import web
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+
+async def serve(port=DEFAULT_PORT, host='localhost'):
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,7 +1,10 @@
+import asyncio
+import threading
+from copy import copy
 from pathlib import Path
 
-from results import render_results
-from utils import subreddit
+import tracing
+import utils
 
 RESULTS_PATH = Path('output/results.png')
 
@@ -31,5 +34,47 @@ class Post:
         return self.score.construct_title(self.options)
 
     def submit(self):
-        render_results(self.score, self.options)
-        subreddit.submit_image(self.title, RESULTS_PATH)
+        from results import render_results
+        with tracing.span('post.submit'):
+            render_results(self.score, self.options)
+            with tracing.span('reddit submit'):
+                utils.get_subreddit().submit_image(self.title, RESULTS_PATH)
+
+    async def upload(self, uploader, callback=None):
+        from results import encode_results
+        with tracing.span('post.upload'):
+            image = await asyncio.to_thread(encode_results, self.score, self.options)
+            return await uploader.upload(self.title, image, callback)
+
+
+class Prerender:
+
+    def __init__(self, post, executor):
+        self.post = post
+        self.executor = executor
+        self.future = None
+        self.cancelled = None
+
+    def start(self):
+        from results import encode_results
+        self.cancel()
+        self.cancelled = threading.Event()
+        self.future = self.executor.submit(tracing.bind(encode_results), self.post.score,
+                                           copy(self.post.options), self.cancelled.is_set)
+
+    def cancel(self):
+        if self.future is not None:
+            self.cancelled.set()
+            self.future.cancel()
+            self.future = None
+
+    async def image(self):
+        if self.future is None:
+            self.start()
+        future = self.future
+        try:
+            return await asyncio.wrap_future(future)
+        except Exception:
+            if self.future is future:
+                self.future = None
+            raise
@@ -0,0 +1,72 @@
+import asyncio
+import sqlite3
+import threading
+from enum import IntEnum
+from pathlib import Path
+from time import time
+
+RATE_LIMIT_PATH = 'ratelimit.db'
+RATE_LIMIT_WINDOW = 60
+
+
+class Priority(IntEnum):
+    POST = 0
+    DEFAULT = 1
+    POLL = 2
+
+
+RESERVED_FRACTION = {
+    Priority.POST:      0,
+    Priority.DEFAULT:   0.05,
+    Priority.POLL:      0.2
+}
+
+
+class RateLimiter:
+
+    def __init__(self, limit, path=RATE_LIMIT_PATH, window=RATE_LIMIT_WINDOW):
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS requests (time REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS requests_time ON requests (time)')
+        self.reader = sqlite3.connect(f'{Path(path).resolve().as_uri()}?mode=ro', uri=True, isolation_level=None,
+                                      check_same_thread=False)
+
+    def capacity(self, priority):
+        return max(1, int(self.limit * (1 - RESERVED_FRACTION[priority])))
+
+    def _try_acquire(self, priority):
+        now = time()
+        capacity = self.capacity(priority)
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.execute('DELETE FROM requests WHERE time <= ?', (now - self.window,))
+                count, = self.db.execute('SELECT COUNT(*) FROM requests').fetchone()
+                if count < capacity:
+                    self.db.execute('INSERT INTO requests VALUES (?)', (now,))
+                    delay = 0
+                else:
+                    cur = self.db.execute('SELECT time FROM requests ORDER BY time LIMIT 1 OFFSET ?',
+                                          (count - capacity,))
+                    oldest, = cur.fetchone()
+                    delay = oldest + self.window - now
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+        return delay
+
+    async def acquire(self, priority=Priority.DEFAULT):
+        while (delay := await asyncio.to_thread(self._try_acquire, priority)) > 0:
+            await asyncio.sleep(delay)
+
+    def current_rate(self):
+        cur = self.reader.execute('SELECT COUNT(*) FROM requests WHERE time > ?',
+                                  (time() - self.window,))
+        count, = cur.fetchone()
+        return count
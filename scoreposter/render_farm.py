@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import time
+
+from colors import color
+from downloads import DownloadCache
+from post import PostOptions
+from snapshot import ScoreSnapshot
+from transport import create_session
+
+BALANCER_PORT = 7290
+WORKER_PORT = 7300
+FRAME_HEADER = struct.Struct('>II')
+BACKGROUND_CACHE = Path('output/render-cache')
+BACKGROUND_CACHE_SIZE = 256 * 2**20
+BACKGROUND_KIND = 'backgrounds'
+HEALTH_RETRY = 30
+RESPAWN_DELAY = 5
+
+
+class RenderError(Exception):
+    pass
+
+
+async def read_frame(reader):
+    header_length, payload_length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    header = json.loads(await reader.readexactly(header_length))
+    payload = await reader.readexactly(payload_length)
+    return header, payload
+
+
+def write_frame(writer, header, payload=b''):
+    encoded = json.dumps(header).encode()
+    writer.write(FRAME_HEADER.pack(len(encoded), len(payload)) + encoded + payload)
+
+
+async def exchange(host, port, header, payload=b''):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        write_frame(writer, header, payload)
+        await writer.drain()
+        return await read_frame(reader)
+    finally:
+        writer.close()
+
+
+def render_job(score, options):
+    if not isinstance(score, ScoreSnapshot):
+        score = ScoreSnapshot.from_score(score)
+    snapshot = score.to_bytes()
+    header = {'options': vars(options), 'snapshot': len(snapshot)}
+    if score.bg_url is not None:
+        header['background'] = score.bg_url
+        return header, snapshot
+    if score.bg_path is not None:
+        try:
+            return header, snapshot + Path(score.bg_path).read_bytes()
+        except FileNotFoundError:
+            pass
+    return header, snapshot
+
+
+class RenderWorker:
+
+    def __init__(self, cache=BACKGROUND_CACHE, max_size=BACKGROUND_CACHE_SIZE):
+        self.backgrounds = DownloadCache(cache, max_size)
+        self.session = None
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='render')
+
+    async def background(self, header, payload):
+        url = header.get('background')
+        if url is None and not payload:
+            return None
+        key = hashlib.sha1(url.encode() if url is not None else payload).hexdigest()
+        if url is not None:
+            if self.session is None:
+                self.session = create_session()
+            path = await self.backgrounds.fetch(self.session, url, BACKGROUND_KIND, key, '')
+        else:
+            await self.backgrounds.load()
+            path = self.backgrounds.get(BACKGROUND_KIND, key, '')
+            if path is None:
+                path = await self.backgrounds.store(BACKGROUND_KIND, key, '', payload)
+        self.backgrounds.pin(path)
+        return path
+
+    def render(self, header, snapshot, background):
+        from results import encode_results
+        bg_path = str(background) if background is not None else None
+        score = ScoreSnapshot.from_bytes(snapshot).replace(bg_path=bg_path)
+        return encode_results(score, PostOptions(**header['options']))
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    header, payload = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+
+                try:
+                    length = header['snapshot']
+                    background = await self.background(header, payload[length:])
+                    try:
+                        image = await loop.run_in_executor(self.executor, self.render, header,
+                                                           payload[:length], background)
+                    finally:
+                        if background is not None:
+                            self.backgrounds.release(background)
+                    write_frame(writer, {'ok': True}, image)
+                except Exception as e:
+                    import traceback
+                    traceback.print_exc()
+                    write_frame(writer, {'ok': False, 'error': repr(e)})
+                await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=WORKER_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.session is not None:
+                await self.session.close()
+
+
+class Backend:
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.active = 0
+        self.retry_at = 0
+
+    def __str__(self):
+        return f'{self.host}:{self.port}'
+
+
+class RenderBalancer:
+
+    def __init__(self, backends):
+        self.backends = [Backend(host, port) for host, port in backends]
+
+    def choose(self, tried):
+        now = time()
+        candidates = [backend for backend in self.backends
+                      if backend not in tried and backend.retry_at <= now]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda backend: backend.active)
+
+    async def dispatch(self, header, payload):
+        tried = set()
+        while (backend := self.choose(tried)) is not None:
+            tried.add(backend)
+            backend.active += 1
+            try:
+                return await exchange(backend.host, backend.port, header, payload)
+            except (OSError, asyncio.IncompleteReadError):
+                backend.retry_at = time() + HEALTH_RETRY
+                print(color(f"Render worker {backend} is unavailable.", fg='red'))
+            finally:
+                backend.active -= 1
+        return {'ok': False, 'error': "No render workers available"}, b''
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    header, payload = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                write_frame(writer, *await self.dispatch(header, payload))
+                await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
+
+    async def spawn(self, backend):
+        arguments = [sys.executable, os.path.abspath(__file__), 'worker',
+                     '--host', backend.host, '--port', str(backend.port)]
+        while True:
+            process = await asyncio.create_subprocess_exec(*arguments)
+            code = await process.wait()
+            print(color(f"Render worker {backend} exited with code {code}, restarting.", fg='red'))
+            await asyncio.sleep(RESPAWN_DELAY)
+
+    async def serve(self, host='127.0.0.1', port=BALANCER_PORT, spawn=0):
+        server = await asyncio.start_server(self.handle, host, port)
+        local = self.backends[len(self.backends) - spawn:]
+        spawners = [asyncio.create_task(self.spawn(backend)) for backend in local]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for spawner in spawners:
+                spawner.cancel()
+
+
+class RemoteRenderer:
+
+    def __init__(self, host='127.0.0.1', port=BALANCER_PORT):
+        self.host = host
+        self.port = port
+
+    async def render(self, score, options):
+        header, payload = await asyncio.to_thread(render_job, score, options)
+        response, image = await exchange(self.host, self.port, header, payload)
+        if not response['ok']:
+            raise RenderError(response['error'])
+        return image
+
+
+def parse_address(address, default_port):
+    host, _, port = address.rpartition(':')
+    if host == '':
+        return address, default_port
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('role', choices=['balancer', 'worker'])
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--backend', dest='backends', action='append', default=[])
+    parser.add_argument('-n', '--spawn', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.role == 'worker':
+        asyncio.run(RenderWorker().serve(args.host, args.port or WORKER_PORT))
+    else:
+        backends = [parse_address(backend, WORKER_PORT) for backend in args.backends]
+        backends += [('127.0.0.1', WORKER_PORT + i) for i in range(args.spawn)]
+        balancer = RenderBalancer(backends)
+        asyncio.run(balancer.serve(args.host, args.port or BALANCER_PORT, args.spawn))
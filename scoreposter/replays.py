@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+import argparse
+import lzma
+import os
+import sqlite3
+import struct
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import utils
+
+REPLAY_INDEX_PATH = 'replays.db'
+REPLAY_SUFFIX = '.osr'
+TICKS_EPOCH = datetime(1, 1, 1)
+HEADER_FIELDS = ['game_mode', 'game_version', 'beatmap_hash', 'player_name', 'replay_hash',
+                 'number_300s', 'number_100s', 'number_50s', 'gekis', 'katus', 'misses',
+                 'score', 'max_combo', 'is_perfect_combo', 'mod_combination', 'timestamp',
+                 'frames_offset', 'frames_length', 'score_id']
+
+
+class ReplayFormatError(Exception):
+    pass
+
+
+class Reader:
+
+    def __init__(self, file):
+        self.file = file
+
+    def read(self, size):
+        data = self.file.read(size)
+        if len(data) != size:
+            raise ReplayFormatError(f"Unexpected end of replay in {self.file.name}")
+        return data
+
+    def unpack(self, format):
+        return struct.unpack(format, self.read(struct.calcsize(format)))[0]
+
+    def uleb128(self):
+        value = shift = 0
+        while True:
+            byte = self.read(1)[0]
+            value |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+
+    def string(self):
+        marker = self.read(1)[0]
+        if marker == 0x00:
+            return None
+        if marker != 0x0b:
+            raise ReplayFormatError(f"Invalid string marker {marker:#x} in {self.file.name}")
+        return self.read(self.uleb128()).decode()
+
+
+class Frame:
+
+    def __init__(self, time_delta, x, y, keys):
+        self.time_delta = time_delta
+        self.x = x
+        self.y = y
+        self.keys = keys
+
+
+class LazyReplay:
+
+    def __init__(self, path, **fields):
+        self.path = Path(path)
+        for field in HEADER_FIELDS:
+            setattr(self, field, fields[field])
+        self._frames = None
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'rb') as file:
+            reader = Reader(file)
+            fields = {
+                'game_mode':        reader.unpack('<B'),
+                'game_version':     reader.unpack('<i'),
+                'beatmap_hash':     reader.string(),
+                'player_name':      reader.string(),
+                'replay_hash':      reader.string(),
+                'number_300s':      reader.unpack('<H'),
+                'number_100s':      reader.unpack('<H'),
+                'number_50s':       reader.unpack('<H'),
+                'gekis':            reader.unpack('<H'),
+                'katus':            reader.unpack('<H'),
+                'misses':           reader.unpack('<H'),
+                'score':            reader.unpack('<i'),
+                'max_combo':        reader.unpack('<H'),
+                'is_perfect_combo': bool(reader.unpack('<B')),
+                'mod_combination':  reader.unpack('<i')
+            }
+            reader.string()
+            ticks = reader.unpack('<q')
+            fields['timestamp'] = TICKS_EPOCH + timedelta(microseconds=ticks//10)
+            fields['frames_length'] = reader.unpack('<i')
+            fields['frames_offset'] = file.tell()
+            file.seek(fields['frames_length'], os.SEEK_CUR)
+            score_id = file.read(8)
+            fields['score_id'] = struct.unpack('<q', score_id)[0] if len(score_id) == 8 else None
+        return cls(path, **fields)
+
+    def fields(self):
+        return {field: getattr(self, field) for field in HEADER_FIELDS}
+
+    @property
+    def frames(self):
+        if self._frames is None:
+            with open(self.path, 'rb') as file:
+                file.seek(self.frames_offset)
+                data = lzma.decompress(file.read(self.frames_length)).decode()
+            self._frames = []
+            for frame in data.split(','):
+                parts = frame.split('|')
+                if len(parts) != 4:
+                    continue
+                time_delta, x, y, keys = parts
+                self._frames.append(Frame(int(time_delta), float(x), float(y), int(keys)))
+        return self._frames
+
+
+def read_replay(path):
+    return LazyReplay.read(path)
+
+
+class ReplayIndex:
+
+    def __init__(self, directory, path=REPLAY_INDEX_PATH):
+        self.directory = Path(directory)
+        self.db = sqlite3.connect(path, timeout=10)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        columns = ', '.join(HEADER_FIELDS)
+        self.db.execute(f'''CREATE TABLE IF NOT EXISTS replays (
+                                name TEXT PRIMARY KEY,
+                                mtime_ns INTEGER NOT NULL,
+                                size INTEGER NOT NULL,
+                                {columns})''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS replays_player ON replays (player_name COLLATE NOCASE)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS replays_beatmap ON replays (beatmap_hash)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS replays_timestamp ON replays (timestamp)')
+
+    def update(self, rescan=True):
+        known = {name: (mtime_ns, size) for name, mtime_ns, size
+                 in self.db.execute('SELECT name, mtime_ns, size FROM replays')}
+        seen = set()
+        changed = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(REPLAY_SUFFIX):
+                    continue
+                seen.add(entry.name)
+                if not rescan and entry.name in known:
+                    continue
+                stat = entry.stat()
+                if known.get(entry.name) != (stat.st_mtime_ns, stat.st_size):
+                    changed.append((entry.name, stat))
+
+        rows = []
+        for name, stat in changed:
+            try:
+                replay = read_replay(self.directory / name)
+            except (OSError, ReplayFormatError, UnicodeDecodeError):
+                continue
+            fields = replay.fields()
+            fields['timestamp'] = fields['timestamp'].isoformat()
+            rows.append((name, stat.st_mtime_ns, stat.st_size, *fields.values()))
+
+        placeholders = ', '.join('?' for _ in range(len(HEADER_FIELDS) + 3))
+        with self.db:
+            self.db.executemany(f'INSERT OR REPLACE INTO replays VALUES ({placeholders})', rows)
+            self.db.executemany('DELETE FROM replays WHERE name = ?',
+                                [(name,) for name in known.keys() - seen])
+        return len(rows)
+
+    def query(self, where='', parameters=(), order='timestamp DESC', limit=None):
+        columns = ', '.join(HEADER_FIELDS)
+        sql = f'SELECT name, {columns} FROM replays {where} ORDER BY {order}'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        replays = []
+        for name, *values in self.db.execute(sql, parameters):
+            fields = dict(zip(HEADER_FIELDS, values))
+            fields['timestamp'] = datetime.fromisoformat(fields['timestamp'])
+            replays.append(LazyReplay(self.directory / name, **fields))
+        return replays
+
+    def latest(self):
+        replays = self.query(limit=1)
+        return replays[0] if replays else None
+
+    def by_player(self, player_name):
+        return self.query('WHERE player_name = ? COLLATE NOCASE', (player_name,))
+
+    def by_beatmap(self, beatmap_hash):
+        return self.query('WHERE beatmap_hash = ?', (beatmap_hash,))
+
+    def all(self):
+        return self.query()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', nargs='?', default=None)
+    parser.add_argument('-p', '--player', type=str)
+    parser.add_argument('-b', '--beatmap', type=str)
+    parser.add_argument('-l', '--latest', action='store_true')
+    args = parser.parse_args()
+
+    index = ReplayIndex(args.directory or utils.OSU_PATH / 'Replays')
+    print(f"Indexed {index.update()} new or changed replays.")
+    if args.latest:
+        replays = [replay for replay in [index.latest()] if replay is not None]
+    elif args.player is not None:
+        replays = index.by_player(args.player)
+    elif args.beatmap is not None:
+        replays = index.by_beatmap(args.beatmap)
+    else:
+        replays = index.all()
+    for replay in replays:
+        print(f"{replay.timestamp:%Y-%m-%d %H:%M}  {replay.player_name}  {replay.beatmap_hash}  {replay.path.name}")
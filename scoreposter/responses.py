@@ -0,0 +1,84 @@
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+from time import time
+
+import metrics
+from ratelimit import Priority
+
+RESPONSES_PATH = 'responses.db'
+
+
+class ResponseCache:
+
+    def __init__(self, rules, path=RESPONSES_PATH):
+        self.rules = [(version, re.compile(pattern), ttl) for version, pattern, ttl in rules]
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses '
+                        '(key TEXT PRIMARY KEY, expires REAL NOT NULL, data TEXT NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)')
+        self.db.commit()
+        self.writer = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.writer.execute('PRAGMA synchronous=NORMAL')
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def ttl(self, endpoint, version):
+        for rule_version, pattern, ttl in self.rules:
+            if rule_version is version and pattern.fullmatch(endpoint):
+                return ttl
+        return 0
+
+    @staticmethod
+    def key(endpoint, parameters, version):
+        items = parameters.items() if isinstance(parameters, dict) else parameters
+        return json.dumps([version.value, endpoint, sorted((str(k), str(v)) for k, v in items)])
+
+    def get(self, key):
+        cur = self.db.execute('SELECT data FROM responses WHERE key=? AND expires>?',
+                              (key, time()))
+        result = cur.fetchone()
+        cur.close()
+        if result is None:
+            return None
+        return json.loads(result[0])
+
+    def put(self, key, data, ttl):
+        now = time()
+        with self.lock, self.writer:
+            self.writer.execute('DELETE FROM responses WHERE expires<=?', (now,))
+            self.writer.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                                (key, now + ttl, json.dumps(data)))
+
+    def done(self, key, priority):
+        tasks = self.pending[key]
+        del tasks[priority]
+        if not tasks:
+            del self.pending[key]
+
+    async def fetch(self, endpoint, parameters, version, request, priority=Priority.DEFAULT):
+        key = self.key(endpoint, parameters, version)
+        ttl = self.ttl(endpoint, version)
+        if ttl > 0 and (data := self.get(key)) is not None:
+            metrics.CACHE_LOOKUPS.inc(cache='responses', result='hit')
+            return data
+
+        tasks = self.pending.setdefault(key, {})
+        task = next((task for task_priority, task in tasks.items() if task_priority <= priority), None)
+        if task is None:
+            metrics.CACHE_LOOKUPS.inc(cache='responses', result='miss')
+            task = asyncio.create_task(self._fetch(key, ttl, request))
+            tasks[priority] = task
+            task.add_done_callback(lambda _: self.done(key, priority))
+        else:
+            metrics.CACHE_LOOKUPS.inc(cache='responses', result='shared')
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, ttl, request):
+        data = await request()
+        if ttl > 0 and data is not None and not (isinstance(data, dict) and 'error' in data):
+            await asyncio.to_thread(self.put, key, data, ttl)
+        return data
@@ -6,16 +6,16 @@ from enum import Enum, auto
 from io import BytesIO
 from pathlib import Path
 
-import cairosvg
 import cv2
 import numpy as np
 import requests
+import tracing
 from osrparse.enums import Mod
 from PIL import Image, ImageDraw, ImageFont
 from score import Rank, Score
-from utils import MODS, OsuAPI
+from utils import MODS, OsuAPI, osu_url
 
-ASSETS_PATH = Path('../assets')
+ASSETS_PATH = Path(__file__).resolve().parent.parent / 'assets'
 FONT_PATH = ASSETS_PATH / 'TruenoRg.otf'
 RANK_COLORS = {
     Rank.SS_PLUS:   '#cdd0c8ff',
@@ -276,8 +276,9 @@ def render(func):
     def wrapper(score, position, layers, i=FG_LAYER):
         nonlocal func
         try:
-            renderables = func(score)
-            render_chain(renderables, position, layers, i)
+            with tracing.span(func.__name__):
+                renderables = func(score)
+                render_chain(renderables, position, layers, i)
         except Exception as e:
             print(f"Error in rendering function {func.__name__}:")
             print(e)
@@ -351,7 +352,8 @@ def render_ranks(score):
     country_rank = score.user['statistics']['rank']['country']
     country_code = score.user['country']['code']
     image_name = '-'.join(letter_to_regional_indicator(letter) for letter in country_code)
-    response = requests.get(f'http://osu.ppy.sh/assets/images/flags/{image_name}.svg', stream=True)
+    response = requests.get(f'{osu_url()}/assets/images/flags/{image_name}.svg', stream=True)
+    import cairosvg
     png = cairosvg.svg2png(bytestring=response.content, scale=16)
     image = Image.open(BytesIO(png)).convert('RGBA')
     array = cv2.cvtColor(np.array(image), cv2.COLOR_RGBA2BGRA)
@@ -455,6 +457,15 @@ def render_sliderbreaks(score):
     return (TextRenderable(str(score.sliderbreaks), SB_SIZE, WHITE),)
 
 
+def load_background(bg_path):
+    image = None
+    if bg_path is not None:
+        image = cv2.imread(str(bg_path), cv2.IMREAD_COLOR)
+    if image is None:
+        return np.zeros((1080, 1920, 3), dtype=np.uint8)
+    return crop_background(image)
+
+
 def crop_background(image):
     height, width, _ = image.shape
     if width/height >= 1920/1080:
@@ -478,7 +489,15 @@ def flatten(layers):
     return np.einsum('ijkl,ijk->jkl', opaque, coeffs)
 
 
-def render_results(score, options, output_path=Path('output/results.png')):
+class RenderCancelled(Exception):
+    pass
+
+
+def render_layers(score, options, cancelled=None):
+    def check():
+        if cancelled is not None and cancelled():
+            raise RenderCancelled()
+
     template_dir = ASSETS_PATH / 'templates'
     if score.misses != 0:
         if score.sliderbreaks != 0:
@@ -490,20 +509,23 @@ def render_results(score, options, output_path=Path('output/results.png')):
     else:
         template_path = template_dir / 'fc.png'
 
-    background = crop_background(cv2.imread(str(score.bg_path), cv2.IMREAD_COLOR))
+    background = load_background(score.bg_path)
     background = cv2.cvtColor(background, cv2.COLOR_BGR2BGRA)
     template = cv2.imread(str(template_path), cv2.IMREAD_UNCHANGED)
     layers = np.zeros([5, 1080, 1920, 4], dtype=np.uint8)
     layers[0] = background
     layers[1] = template
+    check()
 
     render_rank_letter(score, RANK_LETTER_POSITION, layers)
     render_accuracy(score, ACCURACY_POSITION, layers, 2)
     render_stars(score, STARS_POSITION, layers)
     render_pfp(score, PFP_POSITION, layers)
+    check()
     render_username(score, USERNAME_POSITION, layers)
     render_combo(score, COMBO_POSITION, layers)
     render_ranks(score, RANKS_POSITION, layers)
+    check()
     render_title(score, TITLE_POSITION, layers)
     render_mods(score, MODS_POSITION, layers)
     render_hits(score, HITS_POSITION, layers)
@@ -522,9 +544,24 @@ def render_results(score, options, output_path=Path('output/results.png')):
         if score.misses != 0:
             sb_pos.y = 758
         render_sliderbreaks(score, sb_pos, layers)
+    check()
 
-    flattened = flatten(layers)
-    cv2.imwrite(str(output_path), flattened)
+    return flatten(layers)
+
+
+def encode_results(score, options, cancelled=None):
+    with tracing.span('render'):
+        layers = render_layers(score, options, cancelled)
+        with tracing.span('encode png'):
+            _, image = cv2.imencode('.png', layers)
+    return image.tobytes()
+
+
+def render_results(score, options, output_path=Path('output/results.png')):
+    with tracing.span('render'):
+        layers = render_layers(score, options)
+        with tracing.span('write png'):
+            cv2.imwrite(str(output_path), layers)
 
 
 async def create_score(replay_path):
@@ -542,8 +579,8 @@ if __name__ == "__main__":
         replay_path = argv[1]
     else:
         from utils import OSU_PATH
-        replays = (OSU_PATH / 'Replays').glob('*.osr')
-        replay_path = max(replays, key=lambda path: path.stat().st_mtime)
+        from watcher import latest_replay
+        replay_path = latest_replay(OSU_PATH / 'Replays')
     score = asyncio.run(create_score(replay_path))
     options = PostOptions()
     render_results(score, options)
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+MIN_INTERVAL = 1
+ONLINE_INTERVAL = 10
+ACTIVE_MAX_INTERVAL = 30
+IDLE_INTERVAL = 60
+MAX_INTERVAL = 600
+ACTIVE_WINDOW = 30*60
+DEFAULT_CADENCE = 150
+EARLY_FACTOR = 0.5
+SMOOTHING = 0.3
+MAX_BACKOFF = 10
+SPEED_MODS = {'DT': 1.5, 'NC': 1.5, 'HT': 0.75}
+
+
+def play_length(play):
+    length = play.get('beatmap', {}).get('total_length')
+    if not length:
+        return DEFAULT_CADENCE
+    for mod in play.get('mods', []):
+        length /= SPEED_MODS.get(mod, 1)
+    return length
+
+
+class PlayerSchedule:
+
+    def __init__(self, min_interval=MIN_INTERVAL):
+        self.min_interval = min_interval
+        self.last_play = None
+        self.cadence = DEFAULT_CADENCE
+        self.idle_polls = 0
+        self.last_polled = 0
+
+    def observe(self, plays):
+        if len(plays) == 0:
+            self.idle_polls += 1
+            return
+
+        latest = datetime.fromisoformat(plays[0]['created_at']).timestamp()
+        if self.last_play is None:
+            self.last_play = latest
+            self.cadence = play_length(plays[0])
+            return
+        if latest <= self.last_play:
+            self.idle_polls += 1
+            return
+
+        gap = latest - self.last_play
+        self.last_play = latest
+        self.idle_polls = 0
+        if gap < ACTIVE_WINDOW:
+            self.cadence = (1 - SMOOTHING)*self.cadence + SMOOTHING*max(gap, self.min_interval)
+
+    def interval(self, now, online=None):
+        if self.last_play is None or now - self.last_play > ACTIVE_WINDOW:
+            if online:
+                return ONLINE_INTERVAL
+            return min(MAX_INTERVAL, IDLE_INTERVAL * 2**min(self.idle_polls, MAX_BACKOFF))
+
+        earliest = self.last_play + EARLY_FACTOR*self.cadence
+        if now < earliest:
+            return max(self.min_interval, (earliest - now)/2)
+        overdue = (now - earliest)/self.cadence
+        return min(ACTIVE_MAX_INTERVAL, self.min_interval * 2**min(overdue, MAX_BACKOFF))
+
+
+class PollScheduler:
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.schedules = {}
+
+    def schedule(self, user_id):
+        if user_id not in self.schedules:
+            self.schedules[user_id] = PlayerSchedule()
+        return self.schedules[user_id]
+
+    def next_polls(self, players, now):
+        intervals = {player.user_id: self.schedule(player.user_id).interval(now, player.online)
+                     for player in players}
+        rate = sum(60/interval for interval in intervals.values())
+        scale = max(1, rate/self.budget)
+        return {user_id: self.schedules[user_id].last_polled + interval*scale
+                for user_id, interval in intervals.items()}
@@ -1,18 +1,14 @@
 import asyncio
+from datetime import datetime, timezone
 from enum import Enum
-from functools import reduce
-from pathlib import Path
-from re import search
 
-import aiofiles
-import oppai
+import tracing
 import utils
-from circleguard import ReplayPath
 from colors import color
-from osrparse import parse_replay_file
 from osrparse.enums import Mod
-from slider.beatmap import Beatmap
-from slider.replay import Replay
+from replays import read_replay
+from workers import (AnalysisJob, calculate_pp, calculate_stars, calculate_ur,
+                     count_sliderbreaks)
 
 
 class Rank(Enum):
@@ -26,81 +22,164 @@ class Rank(Enum):
     D = 'D'
 
 
+class Stage:
+
+    def __init__(self, name, requires=(), executor=False):
+        self.name = name
+        self.requires = requires
+        self.executor = executor
+
+
+async def run_stages(obj, stages):
+    loop = asyncio.get_running_loop()
+    tasks = {}
+
+    async def run(stage):
+        await asyncio.gather(*(tasks[name] for name in stage.requires))
+        func = getattr(obj, stage.name)
+        with tracing.span(stage.name):
+            if stage.executor:
+                return await loop.run_in_executor(None, tracing.bind(func))
+            result = func()
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result
+
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = set(stage.requires) - names
+        if missing:
+            raise ValueError(f"Stage {stage.name} requires unknown stages: {', '.join(missing)}")
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.create_task(run(stage), name=stage.name)
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+
+
+REPLAY_STAGES = (
+    Stage('parse_replay', executor=True),
+    Stage('process_beatmap', requires=('parse_replay',)),
+    Stage('calculate_accuracy', requires=('parse_replay',)),
+    Stage('get_rank', requires=('parse_replay',)),
+    Stage('get_id', requires=('parse_replay',)),
+    Stage('find_submission', requires=('get_id', 'process_beatmap')),
+    Stage('get_user', requires=('get_id',)),
+    Stage('get_status', requires=('find_submission',)),
+    Stage('get_ranking', requires=('get_status',)),
+    Stage('get_background', requires=('process_beatmap',)),
+    Stage('get_difficulty', requires=('process_beatmap',)),
+    Stage('calculate_sliderbreaks', requires=('process_beatmap',), executor=True),
+    Stage('calculate_statistics', requires=('get_status', 'calculate_accuracy'), executor=True),
+    Stage('find_ur', requires=('process_beatmap',))
+)
+
+OFFLINE_STAGES = (
+    Stage('parse_replay', executor=True),
+    Stage('process_beatmap', requires=('parse_replay',)),
+    Stage('calculate_accuracy', requires=('parse_replay',)),
+    Stage('get_rank', requires=('parse_replay',)),
+    Stage('estimate_difficulty', requires=('process_beatmap',), executor=True),
+    Stage('calculate_sliderbreaks', requires=('process_beatmap',), executor=True),
+    Stage('calculate_statistics', requires=('process_beatmap', 'calculate_accuracy'), executor=True),
+    Stage('find_ur', requires=('process_beatmap',))
+)
+
+SUBMISSION_STAGES = (
+    Stage('download_replay'),
+    Stage('parse_replay', requires=('download_replay',), executor=True),
+    Stage('process_beatmap', requires=('parse_replay',)),
+    Stage('get_user'),
+    Stage('get_status'),
+    Stage('get_ranking', requires=('get_status', 'process_beatmap')),
+    Stage('get_background', requires=('process_beatmap',)),
+    Stage('get_difficulty', requires=('process_beatmap',)),
+    Stage('calculate_sliderbreaks', requires=('process_beatmap',), executor=True),
+    Stage('calculate_statistics', requires=('get_status', 'process_beatmap'), executor=True),
+    Stage('find_ur', requires=('process_beatmap',))
+)
+
+ANALYSIS_STAGES = {'calculate_sliderbreaks', 'calculate_statistics', 'find_ur'}
+
+
+def offload_analysis(stages):
+    kept = []
+    requires = []
+    for stage in stages:
+        if stage.name in ANALYSIS_STAGES:
+            requires.extend(name for name in stage.requires if name not in requires)
+        else:
+            kept.append(stage)
+    kept.append(Stage('analyze', requires=tuple(requires)))
+    return tuple(kept)
+
+
 class Score:
 
-    def __init__(self, osu_api):
+    def __init__(self, osu_api, pool=None):
         self.osu_api = osu_api
+        self.pool = pool
+        self.submission = None
+        self.cg_replay = None
+        self.needs_bg = False
+        self.bg_url = None
+        self.ranked = False
+        self.loved = False
+        self.submitted = True
+        self.ranking = None
 
     @classmethod
-    async def from_replay(cls, replay_path, osu_api):
-        score = cls(osu_api)
+    async def from_replay(cls, replay_path, osu_api, pool=None):
+        score = cls(osu_api, pool)
         await score._from_replay(replay_path)
         return score
 
     @classmethod
-    async def from_submission(cls, submission, osu_api):
-        score = cls(osu_api)
+    async def from_submission(cls, submission, osu_api, pool=None):
+        score = cls(osu_api, pool)
         await score._from_submission(submission)
         return score
 
+    def stages(self, stages):
+        if self.pool is None:
+            return stages
+        return offload_analysis(stages)
+
     async def _from_submission(self, submission):
         self.submission = submission
-        self.replay_path = await self.osu_api.download_replay(self.submission['best_id'])
-        self.replay = parse_replay_file(self.replay_path)
-        self.process_submission()
-        self.process_replay()
-        self.get_mods()
-        needs_bg = self.process_beatmap()
-
-        self.cg_replay = None
-
-        user_task = asyncio.create_task(self.get_user())
-        bg_task = asyncio.create_task(self.get_background(needs_bg))
-        status_task = asyncio.create_task(self.get_status())
-        ranking_task = asyncio.create_task(self.get_ranking())
-        diff_task = asyncio.create_task(self.get_difficulty())
-
-        await user_task
-        await bg_task
-        await status_task
-        await ranking_task
-        await diff_task
-
-        self.calculate_sliderbreaks()
-        self.calculate_statistics()
-        self.find_ur()
+        with tracing.span('score.from_submission', score_id=submission['best_id']):
+            self.process_submission()
+            await run_stages(self, self.stages(SUBMISSION_STAGES))
 
     async def _from_replay(self, replay_path):
         self.replay_path = replay_path
-        self.replay = parse_replay_file(self.replay_path)
+        with tracing.span('score.from_replay', replay=str(replay_path)):
+            if self.osu_api is None:
+                await run_stages(self, self.stages(OFFLINE_STAGES))
+            else:
+                await run_stages(self, self.stages(REPLAY_STAGES))
+
+    async def analyze(self):
+        job = AnalysisJob(self.replay_path, self.map_path, self.mods,
+                          self.combo, self.misses, self.accuracy)
+        result = await self.pool.analyze(job)
+        self.sliderbreaks = result.sliderbreaks
+        self.ur = result.ur
+        self.apply_statistics(result.max_combo, result.pp, result.fcpp)
+
+    async def download_replay(self):
+        self.replay_path = await self.osu_api.download_replay(self.submission['best_id'],
+                                                              owner=self)
+
+    def parse_replay(self):
+        self.replay = read_replay(self.replay_path)
         self.process_replay()
         self.get_mods()
 
-        self.submission = None
-        self.cg_replay = None
-
-        needs_bg = self.process_beatmap()
-        await self.get_id()
-        await self.find_submission()
-
-        user_task = asyncio.create_task(self.get_user())
-        status_task = asyncio.create_task(self.get_status())
-        ranking_task = asyncio.create_task(self.get_ranking())
-        bg_task = asyncio.create_task(self.get_background(needs_bg))
-        diff_task = asyncio.create_task(self.get_difficulty())
-
-        await user_task
-        await status_task
-        await ranking_task
-        await bg_task
-        await diff_task
-
-        self.calculate_accuracy()
-        self.calculate_sliderbreaks()
-        self.calculate_statistics()
-        self.find_ur()
-        self.get_rank()
-
     def process_replay(self):
         self.player = self.replay.player_name
         self.combo = self.replay.max_combo
@@ -115,70 +194,37 @@ class Score:
         self.rank = Rank(self.submission['rank'])
         self.accuracy = self.submission['accuracy'] * 100
 
-    def process_beatmap(self):
-        cur = utils.osu_db.execute('SELECT beatmap_id, folder_name, map_file, artist, '
-                                   'title, difficulty, mapper FROM maps WHERE md5_hash=?',
-                                   (self.replay.beatmap_hash,))
-        result = cur.fetchone()
-        cur.close()
-
-        if result is None:
-            print(color("Beatmap not in osu!.db, defaulting to Circleguard version.",
-                        fg='red'))
-            self.cg_replay = ReplayPath(self.replay_path)
-            beatmap = utils.cg.beatmap(self.cg_replay)
-
-            self.beatmap_id = self.cg_replay.map_info.map_id
-            if self.beatmap_id is None:
-                print(color("Beatmap not found.", fg='red'))
-            print(color("Cached beatmap found!", fg='green'))
-
-            folder_name = utils.cg.library.path
-            cur = utils.cg.library._db.execute('SELECT path from beatmaps WHERE md5=?',
-                                               (self.replay.beatmap_hash,))
-            map_file = cur.fetchone()[0]
-            self.map_path = folder_name / map_file
-            cur.close()
-
-            self.artist = beatmap.artist
-            self.title = beatmap.title
-            self.difficulty = beatmap.version
-            self.mapper = beatmap.creator
-            return True
-
-        self.beatmap_id, folder_name, map_file, self.artist, \
-            self.title, self.difficulty, self.mapper = result
-        map_folder = utils.BEATMAPS_DIR / folder_name
-        self.map_path = map_folder / map_file
-
-        with open(self.map_path) as file:
-            lines = file.readlines()
-        groups = Beatmap._find_groups(lines)
-        events = groups['Events']
-        for line in events:
-            if any(ext in line for ext in ['.jpg', '.jpeg', '.png']):
-                bg_file = search('"(.+?)"', line).group(1)
-                break
-        self.bg_path = map_folder / bg_file
-        return False
-
-    async def get_background(self, needs_bg):
-        if not needs_bg:
+    async def process_beatmap(self):
+        beatmap = await utils.get_beatmaps().resolve(self.replay.beatmap_hash, self.osu_api,
+                                                     priority=utils.Priority.POST, owner=self)
+        self.beatmap_id = beatmap.beatmap_id
+        self.artist = beatmap.artist
+        self.title = beatmap.title
+        self.difficulty = beatmap.difficulty
+        self.mapper = beatmap.mapper
+        self.map_path = beatmap.path
+        if beatmap.background is None or not beatmap.background.exists():
+            self.needs_bg = True
+        else:
+            self.bg_path = beatmap.background
+
+    async def get_background(self):
+        if not self.needs_bg:
             return
 
-        self.bg_path = Path('output/bg')
-        data = await self.osu_api.request(f'beatmaps/{self.beatmap_id}')
+        data = await self.osu_api.request(f'beatmaps/{self.beatmap_id}',
+                                          priority=utils.Priority.POST)
         cover_url = data['beatmapset']['covers']['cover@2x']
-
-        async with self.osu_api.session.get(cover_url) as response:
-            async with aiofiles.open(self.bg_path, 'wb') as image:
-                await image.write(await response.read())
+        self.bg_url = cover_url
+        self.bg_path = await self.osu_api.download_cover(data['beatmapset_id'], cover_url,
+                                                         owner=self)
 
     async def get_id(self):
-        self.user_id = await self.osu_api.username_to_id(self.player)
+        self.user_id = await self.osu_api.username_to_id(self.player, utils.Priority.POST)
 
     async def get_user(self):
-        self.user = await self.osu_api.request(f'users/{self.user_id}/osu')
+        self.user = await self.osu_api.request(f'users/{self.user_id}/osu',
+                                               priority=utils.Priority.POST)
 
     def get_mods(self):
         self.mods = {mod for mod in Mod
@@ -189,17 +235,21 @@ class Score:
         if Mod.Perfect in self.mods:
             self.mods.discard(Mod.SuddenDeath)
 
+    @property
+    def fc(self):
+        return self.misses == 0 and self.sliderbreaks == 0
+
+    def mod_string(self):
+        return ''.join(string for mod, string in utils.MODS.items()
+                       if mod in self.mods)
+
     def calculate_accuracy(self):
         weights = [300/300, 100/300, 50/300, 0/300]
         weighted_sum = sum(hit * weight for hit, weight in zip(self.hits, weights))
         self.accuracy = weighted_sum / sum(self.hits) * 100
 
     def calculate_sliderbreaks(self):
-        replay = Replay.from_path(
-            self.replay_path,
-            beatmap=Beatmap.from_path(self.map_path),
-            retrieve_beatmap=False)
-        self.sliderbreaks = len(replay.hits['slider_breaks'])
+        self.sliderbreaks = count_sliderbreaks(self.replay_path, self.map_path)
 
     def matches_score(self, score):
         stats = score['statistics']
@@ -216,7 +266,7 @@ class Score:
     async def find_submission(self):
         endpoint = f'users/{self.user_id}/scores/recent'
         parameters = {'limit': 10}
-        data = await self.osu_api.request(endpoint, parameters)
+        data = await self.osu_api.request(endpoint, parameters, priority=utils.Priority.POST)
         if 'error' in data or len(data) == 0:
             return
 
@@ -234,7 +284,8 @@ class Score:
         if self.submission is not None:
             self.beatmap = self.submission['beatmap']
         else:
-            self.beatmap = await self.osu_api.request(f'beatmaps/{self.beatmap_id}')
+            self.beatmap = await self.osu_api.request(f'beatmaps/{self.beatmap_id}',
+                                                      priority=utils.Priority.POST)
 
         status = self.beatmap['status']
         if status == 'ranked' or status == 'approved':
@@ -253,52 +304,45 @@ class Score:
                 modnum |= Mod.DoubleTime
 
         parameters = {'b': self.beatmap_id, 'mods': modnum}
-        data = await self.osu_api.request('get_beatmaps', parameters, utils.OsuAPIVersion.V1)
+        data = await self.osu_api.request('get_beatmaps', parameters, utils.OsuAPIVersion.V1,
+                                          utils.Priority.POST)
         self.stars = float(data[0]['difficultyrating'])
 
-    def calculate_statistics(self):
-        ez = oppai.ezpp_new()
-        oppai.ezpp_set_autocalc(ez, 1)
-
-        with open(self.map_path, encoding='utf-8') as file:
-            data = file.read()
-        oppai.ezpp_data_dup(ez, data, len(data.encode('utf-8')))
-        oppai.ezpp_set_mods(ez, reduce(lambda a, v: a | v.value, self.mods, 0))
-
-        self.max_combo = max(self.combo, oppai.ezpp_max_combo(ez))
+    def estimate_difficulty(self):
+        self.stars = calculate_stars(self.map_path, self.mods)
 
-        oppai.ezpp_set_combo(ez, self.combo)
-        oppai.ezpp_set_nmiss(ez, self.misses)
-        oppai.ezpp_set_accuracy_percent(ez, self.accuracy)
+    def calculate_statistics(self):
+        statistics = calculate_pp(self.map_path, self.mods, self.combo,
+                                  self.misses, self.accuracy)
+        self.apply_statistics(*statistics)
 
+    def apply_statistics(self, max_combo, pp, fcpp):
+        self.max_combo = max_combo
         if self.submission is not None and self.ranked and self.submitted:
             self.pp = self.submission['pp']
         else:
-            self.pp = oppai.ezpp_pp(ez)
-
-        oppai.ezpp_set_combo(ez, self.max_combo)
-        oppai.ezpp_set_nmiss(ez, 0)
-        self.fcpp = oppai.ezpp_pp(ez)
-
-        oppai.ezpp_free(ez)
+            self.pp = pp
+        self.fcpp = fcpp
 
     def find_ur(self):
-        if self.cg_replay is None:
-            self.cg_replay = ReplayPath(self.replay_path)
-        self.ur = utils.cg.ur(self.cg_replay)
+        self.ur = calculate_ur(self.replay_path, self.cg_replay, self.map_path)
+
+    def played_at(self):
+        if self.submission is not None:
+            return datetime.fromisoformat(self.submission['created_at']).timestamp()
+        return self.replay.timestamp.replace(tzinfo=timezone.utc).timestamp()
 
     async def get_ranking(self):
         self.ranking = None
         if self.ranked or self.loved:
-            data = await self.osu_api.request(f'beatmaps/{self.beatmap_id}/scores')
-            if 'error' in data:
+            leaderboard = await self.osu_api.leaderboards.get(self.beatmap_id,
+                                                              since=self.played_at())
+            if leaderboard is None:
                 return
 
-            scores = data['scores']
-            for rank, score in enumerate(scores, start=1):
-                if self.matches_score(score):
-                    self.ranking = rank
-                    break
+            rank, score = leaderboard.find(self.user_id)
+            if score is not None and self.matches_score(score):
+                self.ranking = rank
 
     def get_rank(self):
         total_hits = sum(self.hits)
@@ -329,14 +373,10 @@ class Score:
             parenthetical = f"{self.stars:.2f}*"
 
         if self.mods:
-            modstring = ''.join(string for mod, string in utils.MODS.items()
-                                if mod in self.mods)
-            base = f"{self.artist} - {self.title} [{self.difficulty}] +{modstring} ({parenthetical})"
+            base = f"{self.artist} - {self.title} [{self.difficulty}] +{self.mod_string()} ({parenthetical})"
         else:
             base = f"{self.artist} - {self.title} [{self.difficulty}] ({parenthetical})"
 
-        self.fc = self.misses == 0 and self.sliderbreaks == 0
-
         if self.accuracy == 100:
             base += " SS"
         else:
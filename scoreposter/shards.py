@@ -0,0 +1,370 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+from time import time
+
+import utils
+from auth import OsuAuth, OsuAuthenticationMode, Token
+from colors import color
+from jobs import DONE, JobQueue
+from ratelimit import RateLimiter
+from tracker import POLL_BUDGET, Tracker
+from transport import create_session
+from uploader import UPLOAD_WORKERS, Uploader
+from workers import AnalysisPool
+
+COORDINATOR_PORT = 7280
+SHARDS_PATH = 'shards.db'
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TIMEOUT = 20
+RESPAWN_DELAY = 5
+
+
+def weight(worker, user_id):
+    digest = hashlib.blake2b(f'{worker}:{user_id}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def assign(user_ids, workers):
+    assignments = {worker: [] for worker in workers}
+    if not workers:
+        return assignments
+    for user_id in user_ids:
+        assignments[max(workers, key=lambda worker: weight(worker, user_id))].append(user_id)
+    return assignments
+
+
+def encode(message):
+    return json.dumps(message).encode() + b'\n'
+
+
+class Coordinator:
+
+    def __init__(self, user_ids, budget=POLL_BUDGET, path=SHARDS_PATH):
+        self.user_ids = user_ids
+        self.budget = budget
+        self.workers = {}
+        self.auth = None
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS claims (
+                               score_id INTEGER PRIMARY KEY,
+                               worker TEXT NOT NULL,
+                               time REAL NOT NULL,
+                               user_id INTEGER NOT NULL,
+                               play TEXT NOT NULL,
+                               posting INTEGER NOT NULL DEFAULT 0,
+                               done INTEGER NOT NULL DEFAULT 0)''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS cursors (
+                               user_id INTEGER PRIMARY KEY,
+                               play TEXT NOT NULL)''')
+
+    def claim(self, worker, score_id, user_id, play):
+        self.db.execute('INSERT OR IGNORE INTO claims (score_id, worker, time, user_id, play) '
+                        'VALUES (?, ?, ?, ?, ?)', (score_id, worker, time(), user_id, json.dumps(play)))
+        owner, = self.db.execute('SELECT worker FROM claims WHERE score_id = ?', (score_id,)).fetchone()
+        return owner == worker
+
+    def lease(self, worker, score_id):
+        cur = self.db.execute('UPDATE claims SET posting = 1 WHERE score_id = ? AND worker = ? AND done = 0',
+                              (score_id, worker))
+        return cur.rowcount == 1
+
+    def finish(self, worker, score_id):
+        self.db.execute('UPDATE claims SET done = 1 WHERE score_id = ? AND worker = ?', (score_id, worker))
+
+    def reassign(self, assignments):
+        owners = {user_id: worker for worker, user_ids in assignments.items() for user_id in user_ids}
+        cur = self.db.execute('SELECT score_id, worker, user_id, play FROM claims '
+                              'WHERE done = 0 AND posting = 0')
+        for score_id, worker, user_id, play in cur.fetchall():
+            owner = owners.get(user_id)
+            if worker in self.workers or owner is None:
+                continue
+            self.db.execute('DELETE FROM claims WHERE score_id = ?', (score_id,))
+            self.workers[owner].write(encode({'type': 'enqueue', 'play': json.loads(play)}))
+            print(f"Reassigned score {score_id} from {worker} to {owner}")
+
+    def checkpoint(self, user_id, play):
+        self.db.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', (user_id, json.dumps(play)))
+
+    def cursors(self, user_ids):
+        user_ids = set(user_ids)
+        cur = self.db.execute('SELECT user_id, play FROM cursors')
+        return {user_id: json.loads(play) for user_id, play in cur if user_id in user_ids}
+
+    def token(self):
+        if self.auth is None or self.auth.token is None:
+            return None
+        token = self.auth.token
+        return {'token_type': token.token_type, 'access_token': token.access_token, 'expires': token.expires}
+
+    def share_token(self, token):
+        for writer in self.workers.values():
+            writer.write(encode({'type': 'token', 'token': self.token()}))
+
+    def rate_limit(self):
+        return max(1, (utils.OSU_RATE_LIMIT - 1) // max(1, len(self.workers)))
+
+    def rebalance(self):
+        assignments = assign(self.user_ids, sorted(self.workers))
+        budget = self.budget / max(1, len(self.workers))
+        for worker, user_ids in assignments.items():
+            self.workers[worker].write(encode({'type': 'assign', 'user_ids': user_ids,
+                                               'cursors': self.cursors(user_ids), 'budget': budget,
+                                               'rate_limit': self.rate_limit()}))
+        self.reassign(assignments)
+        shards = ", ".join(f"{worker}: {len(user_ids)}" for worker, user_ids in assignments.items())
+        print(f"Shards: {shards or 'none'}")
+
+    async def handle(self, reader, writer):
+        name = None
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), HEARTBEAT_TIMEOUT))
+            name = hello['worker']
+            if name in self.workers:
+                self.workers[name].close()
+            self.workers[name] = writer
+            writer.write(encode({'type': 'welcome', 'rate_limit': self.rate_limit(), 'token': self.token()}))
+            print(color(f"Worker {name} connected.", fg='green'))
+            self.rebalance()
+
+            while line := await asyncio.wait_for(reader.readline(), HEARTBEAT_TIMEOUT):
+                message = json.loads(line)
+                if message['type'] == 'claim':
+                    granted = self.claim(name, message['score_id'], message['user_id'], message['play'])
+                    writer.write(encode({'type': 'granted', 'id': message['id'], 'granted': granted}))
+                elif message['type'] == 'lease':
+                    granted = self.lease(name, message['score_id'])
+                    writer.write(encode({'type': 'granted', 'id': message['id'], 'granted': granted}))
+                elif message['type'] == 'done':
+                    self.finish(name, message['score_id'])
+                elif message['type'] == 'checkpoint':
+                    self.checkpoint(message['user_id'], message['play'])
+                await writer.drain()
+
+        except (asyncio.TimeoutError, ConnectionError, json.JSONDecodeError, KeyError):
+            pass
+
+        finally:
+            writer.close()
+            if name is not None and self.workers.get(name) is writer:
+                del self.workers[name]
+                print(color(f"Worker {name} disconnected.", fg='red'))
+                self.rebalance()
+
+    async def spawn(self, name, host, port, pool_workers=None):
+        arguments = [sys.executable, os.path.abspath(__file__), 'worker',
+                     '--name', name, '--host', host, '--port', str(port)]
+        if pool_workers is not None:
+            arguments += ['-w', str(pool_workers)]
+        while True:
+            process = await asyncio.create_subprocess_exec(*arguments)
+            code = await process.wait()
+            print(color(f"Worker {name} exited with code {code}, restarting.", fg='red'))
+            await asyncio.sleep(RESPAWN_DELAY)
+
+    async def serve(self, host='127.0.0.1', port=COORDINATOR_PORT, workers=0, pool_workers=None):
+        keys = utils.get_keys()
+        self.auth = OsuAuth(keys['osu_id'], keys['osu_secret'], OsuAuthenticationMode.AUTHORIZATION_CODE,
+                            f'{utils.osu_url()}/oauth', on_refresh=self.share_token)
+        session = create_session()
+        await self.auth.start(session)
+        server = await asyncio.start_server(self.handle, host, port)
+        connect_host = '127.0.0.1' if host in ('', '0.0.0.0') else host
+        spawners = [asyncio.create_task(self.spawn(f'local-{i}', connect_host, port, pool_workers))
+                    for i in range(workers)]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for spawner in spawners:
+                spawner.cancel()
+            await self.auth.stop()
+            await session.close()
+
+
+class SharedAuth:
+
+    def __init__(self):
+        self.token = None
+        self.updated = asyncio.Event()
+
+    def update(self, data):
+        if data is None:
+            return
+        self.token = Token(**data)
+        self.updated.set()
+
+    async def start(self, session):
+        await self.ensure()
+
+    async def stop(self):
+        pass
+
+    @property
+    def headers(self):
+        return self.token.headers
+
+    async def ensure(self):
+        while self.token is None or not self.token.valid():
+            self.updated.clear()
+            await self.updated.wait()
+
+
+class ShardClient:
+
+    def __init__(self, name, host='127.0.0.1', port=COORDINATOR_PORT):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.cursors = {}
+        self.rate_limit = None
+        self.auth = SharedAuth()
+        self.requests = {}
+        self.next_request = 0
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.send({'type': 'hello', 'worker': self.name})
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Coordinator closed the connection")
+        welcome = json.loads(line)
+        self.rate_limit = welcome['rate_limit']
+        self.auth.update(welcome['token'])
+
+    def send(self, message):
+        self.writer.write(encode(message))
+
+    async def request(self, message):
+        self.next_request += 1
+        future = asyncio.get_running_loop().create_future()
+        self.requests[self.next_request] = future
+        self.send({**message, 'id': self.next_request})
+        return await future
+
+    async def claim(self, score_id, user_id, play):
+        return await self.request({'type': 'claim', 'score_id': score_id, 'user_id': user_id, 'play': play})
+
+    async def lease(self, score_id):
+        return await self.request({'type': 'lease', 'score_id': score_id})
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            self.send({'type': 'heartbeat'})
+            await self.writer.drain()
+
+    async def listen(self, tracker):
+        while line := await self.reader.readline():
+            message = json.loads(line)
+            if message['type'] == 'assign':
+                self.cursors.update({int(user_id): play for user_id, play in message['cursors'].items()})
+                tracker.poller.scheduler.budget = message['budget']
+                tracker.osu_api.limiter.limit = message['rate_limit']
+                tracker.assign(message['user_ids'])
+                print(f"Assigned {len(message['user_ids'])} players, "
+                      f"budget {message['budget']:.0f} polls and {message['rate_limit']} requests per minute")
+            elif message['type'] == 'granted':
+                future = self.requests.pop(message['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(message['granted'])
+            elif message['type'] == 'token':
+                self.auth.update(message['token'])
+            elif message['type'] == 'enqueue':
+                tracker.jobs.enqueue(message['play'])
+        raise ConnectionError("Lost connection to coordinator")
+
+
+class ShardJobQueue(JobQueue):
+
+    def __init__(self, client, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = client
+
+    def cursor(self, user_id):
+        return self.client.cursors.get(user_id)
+
+    def checkpoint(self, user_id, play):
+        self.client.cursors[user_id] = play
+        self.client.send({'type': 'checkpoint', 'user_id': user_id, 'play': play})
+
+    def enqueue(self, play, detected=None, cursor=None):
+        queued = super().enqueue(play, detected)
+        if cursor is not None:
+            self.checkpoint(*cursor)
+        return queued
+
+    def advance(self, job, stage, **fields):
+        super().advance(job, stage, **fields)
+        if stage == DONE:
+            self.client.send({'type': 'done', 'score_id': job.score_id})
+
+    def fail(self, job, stage, error):
+        retry = super().fail(job, stage, error)
+        if not retry:
+            self.client.send({'type': 'done', 'score_id': job.score_id})
+        return retry
+
+    async def analyze(self, job):
+        if not await self.client.claim(job.score_id, job.user_id, job.submission):
+            self.advance(job, DONE)
+            return
+        await super().analyze(job)
+
+    async def post(self, job):
+        if not await self.client.lease(job.score_id):
+            self.advance(job, DONE)
+            return
+        await super().post(job)
+
+
+async def run_worker(name, host='127.0.0.1', port=COORDINATOR_PORT, workers=None,
+                     stage_workers=(2, 1, UPLOAD_WORKERS)):
+    analysis_workers, render_workers, post_workers = stage_workers
+    client = ShardClient(name, host, port)
+    await client.connect()
+    osu_api = utils.OsuAPI()
+    osu_api.auth = client.auth
+    async with osu_api, \
+               AnalysisPool(workers) as pool, \
+               Uploader(post_workers) as uploader:
+        osu_api.limiter = RateLimiter(client.rate_limit, f'ratelimit-{name}.db')
+        jobs = ShardJobQueue(client, osu_api, uploader, pool, path=f'jobs-{name}.db',
+                             analysis_workers=analysis_workers, render_workers=render_workers)
+        tracker = Tracker([], osu_api, pool, jobs=jobs)
+        await asyncio.gather(client.listen(tracker), client.heartbeat())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('role', choices=['coordinator', 'worker'])
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=COORDINATOR_PORT)
+    parser.add_argument('-n', '--shards', type=int, default=0)
+    parser.add_argument('-b', '--budget', type=int, default=POLL_BUDGET)
+    parser.add_argument('--name', type=str, default=f'{socket.gethostname()}-{os.getpid()}')
+    parser.add_argument('-w', '--workers', type=int)
+    args = parser.parse_args()
+
+    if args.role == 'coordinator':
+        with open(utils.WHITELIST_PATH) as whitelist:
+            user_ids = [int(line) for line in whitelist.readlines()]
+        coordinator = Coordinator(user_ids, args.budget)
+        asyncio.run(coordinator.serve(args.host, args.port, args.shards, args.workers))
+    else:
+        try:
+            asyncio.run(run_worker(args.name, args.host, args.port, args.workers))
+        except ConnectionError as e:
+            print(color(str(e), fg='red'))
+            sys.exit(1)
@@ -0,0 +1,150 @@
+import math
+import struct
+
+from osrparse.enums import Mod
+from score import Rank, Score
+
+SNAPSHOT_VERSION = 1
+NUMBERS = struct.Struct('<BB5d9IB')
+STRING_LENGTH = struct.Struct('<H')
+NO_STRING = 0xFFFF
+RANKS = list(Rank)
+
+LOVED = 1
+RANKED = 2
+SUBMITTED = 4
+
+STRING_FIELDS = ['player', 'artist', 'title', 'difficulty', 'mapper',
+                 'avatar_url', 'country_code', 'bg_path', 'bg_url']
+
+
+def encode_float(value):
+    return math.nan if value is None else value
+
+
+def decode_float(value):
+    return None if math.isnan(value) else value
+
+
+class ScoreSnapshot:
+
+    __slots__ = ('player', 'artist', 'title', 'difficulty', 'mapper', 'stars', 'mods',
+                 'accuracy', 'misses', 'sliderbreaks', 'combo', 'max_combo', 'hits',
+                 'rank', 'ranking', 'loved', 'ranked', 'submitted', 'pp', 'fcpp', 'ur',
+                 'avatar_url', 'global_rank', 'country_rank', 'country_code',
+                 'bg_path', 'bg_url')
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            value = fields.pop(field)
+            if field == 'mods':
+                value = frozenset(value)
+            elif field == 'hits':
+                value = tuple(value)
+            object.__setattr__(self, field, value)
+        if fields:
+            raise TypeError(f"Unexpected snapshot fields: {', '.join(fields)}")
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, ScoreSnapshot):
+            return NotImplemented
+        return self.fields() == other.fields()
+
+    def __hash__(self):
+        return hash(self.to_bytes())
+
+    def __reduce__(self):
+        return ScoreSnapshot.from_bytes, (self.to_bytes(),)
+
+    fc = Score.fc
+    mod_string = Score.mod_string
+    construct_title = Score.construct_title
+
+    @property
+    def user(self):
+        return {
+            'avatar_url': self.avatar_url,
+            'statistics': {'global_rank': self.global_rank, 'rank': {'country': self.country_rank}},
+            'country': {'code': self.country_code}
+        }
+
+    def fields(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def replace(self, **changes):
+        return ScoreSnapshot(**{**self.fields(), **changes})
+
+    @classmethod
+    def from_score(cls, score):
+        user = score.user or {}
+        statistics = user.get('statistics') or {}
+        bg_path = getattr(score, 'bg_path', None)
+        return cls(player=score.player, artist=score.artist, title=score.title,
+                   difficulty=score.difficulty, mapper=score.mapper, stars=score.stars,
+                   mods=score.mods, accuracy=score.accuracy, misses=score.misses,
+                   sliderbreaks=score.sliderbreaks, combo=score.combo, max_combo=score.max_combo,
+                   hits=score.hits, rank=score.rank, ranking=score.ranking, loved=score.loved,
+                   ranked=score.ranked, submitted=score.submitted, pp=score.pp,
+                   fcpp=score.fcpp, ur=score.ur, avatar_url=user.get('avatar_url'),
+                   global_rank=statistics.get('global_rank'),
+                   country_rank=(statistics.get('rank') or {}).get('country'),
+                   country_code=(user.get('country') or {}).get('code'),
+                   bg_path=str(bg_path) if bg_path is not None else None,
+                   bg_url=score.bg_url)
+
+    def to_bytes(self):
+        flags = (LOVED if self.loved else 0) | (RANKED if self.ranked else 0) | \
+                (SUBMITTED if self.submitted else 0)
+        numbers = NUMBERS.pack(SNAPSHOT_VERSION, flags,
+                               self.accuracy, self.stars, encode_float(self.pp),
+                               encode_float(self.fcpp), encode_float(self.ur),
+                               self.misses, self.sliderbreaks, self.combo, self.max_combo,
+                               self.ranking or 0, self.global_rank or 0, self.country_rank or 0,
+                               sum(int(mod) for mod in self.mods), len(self.hits),
+                               RANKS.index(self.rank))
+        parts = [numbers, struct.pack(f'<{len(self.hits)}I', *self.hits)]
+        for field in STRING_FIELDS:
+            value = getattr(self, field)
+            if value is None:
+                parts.append(STRING_LENGTH.pack(NO_STRING))
+            else:
+                encoded = value.encode()
+                parts.append(STRING_LENGTH.pack(len(encoded)))
+                parts.append(encoded)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = memoryview(data)
+        (version, flags, accuracy, stars, pp, fcpp, ur, misses, sliderbreaks, combo, max_combo,
+         ranking, global_rank, country_rank, mods, hit_count, rank) = NUMBERS.unpack_from(data)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        offset = NUMBERS.size
+        hits = struct.unpack_from(f'<{hit_count}I', data, offset)
+        offset += 4*hit_count
+
+        strings = {}
+        for field in STRING_FIELDS:
+            length, = STRING_LENGTH.unpack_from(data, offset)
+            offset += STRING_LENGTH.size
+            if length == NO_STRING:
+                strings[field] = None
+            else:
+                strings[field] = bytes(data[offset:offset + length]).decode()
+                offset += length
+
+        return cls(stars=stars, mods={mod for mod in Mod if mod & mods},
+                   accuracy=accuracy, misses=misses, sliderbreaks=sliderbreaks, combo=combo,
+                   max_combo=max_combo, hits=hits, rank=RANKS[rank], ranking=ranking or None,
+                   loved=bool(flags & LOVED), ranked=bool(flags & RANKED),
+                   submitted=bool(flags & SUBMITTED), pp=decode_float(pp),
+                   fcpp=decode_float(fcpp), ur=decode_float(ur),
+                   global_rank=global_rank or None, country_rank=country_rank or None,
+                   **strings)
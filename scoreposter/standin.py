@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import json
+import random
+import re
+from collections import Counter, deque
+from pathlib import Path
+from time import time
+from urllib.parse import urlencode
+
+import aiohttp
+import requests
+from aiohttp import web
+
+FIXTURES_DIR = Path('fixtures')
+SUBMISSIONS_DIR = Path('output/submissions')
+DEFAULT_PORT = 7271
+BINARY_SUFFIXES = ['.osr', '.osu', '.jpg', '.png', '.svg']
+IGNORED_PARAMETERS = {'k'}
+
+
+class StandInSubreddit:
+
+    def __init__(self, url):
+        self.url = url
+
+    def submit_image(self, title, image_path):
+        with open(image_path, 'rb') as image:
+            response = requests.post(f'{self.url}/reddit/submit', data={'title': title},
+                                     files={'image': image})
+        response.raise_for_status()
+        return response.json()['url']
+
+
+class Fixtures:
+
+    def __init__(self, directory=FIXTURES_DIR):
+        self.directory = Path(directory)
+        self.sequences = {}
+
+    @staticmethod
+    def query(parameters):
+        items = sorted((key, value) for key, value in parameters.items()
+                       if key not in IGNORED_PARAMETERS)
+        return urlencode(items)
+
+    def candidates(self, path, parameters):
+        path = path.strip('/')
+        generic = re.sub(r'(?<=/)\d+(?=/|$)', '_', path)
+        query = self.query(parameters)
+        for base in dict.fromkeys([path, generic]):
+            if query:
+                yield self.directory / f'{base}@{query}'
+            yield self.directory / base
+
+    def find(self, path, parameters):
+        for candidate in self.candidates(path, parameters):
+            if candidate.suffix in BINARY_SUFFIXES and candidate.is_file():
+                return candidate
+            for suffix in ['.json'] + BINARY_SUFFIXES:
+                fixture = candidate.with_name(candidate.name + suffix)
+                if fixture.is_file():
+                    return fixture
+        return None
+
+    def load(self, fixture):
+        if fixture.suffix != '.json':
+            return fixture.read_bytes(), None
+
+        data = json.loads(fixture.read_text())
+        if isinstance(data, dict) and '__sequence__' in data:
+            sequence = data['__sequence__']
+            index = self.sequences.get(fixture, 0)
+            self.sequences[fixture] = min(index + 1, len(sequence) - 1)
+            data = sequence[index]
+        return json.dumps(data).encode(), 'application/json'
+
+    def record(self, path, parameters, body, content_type):
+        query = self.query(parameters)
+        name = path.strip('/') + (f'@{query}' if query else '')
+        if content_type is not None and 'json' in content_type:
+            fixture = self.directory / f'{name}.json'
+        elif any(name.endswith(suffix) for suffix in BINARY_SUFFIXES):
+            fixture = self.directory / name
+        else:
+            suffix = '.osu' if path.strip('/').startswith('osu/') else '.osr'
+            fixture = self.directory / f'{name}{suffix}'
+        fixture.parent.mkdir(parents=True, exist_ok=True)
+        fixture.write_bytes(body)
+
+
+class StandInServer:
+
+    def __init__(self, fixtures, latency=0, jitter=0, rate_limit=None, error_rate=0,
+                 upstream=None, submissions_dir=SUBMISSIONS_DIR):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.upstream = upstream
+        self.submissions_dir = Path(submissions_dir)
+        self.requests = deque()
+        self.submissions = 0
+        self.counts = Counter()
+        self.session = None
+
+    def application(self):
+        app = web.Application(middlewares=[self.simulate])
+        app.router.add_post('/oauth/token', self.token)
+        app.router.add_post('/reddit/submit', self.submit)
+        app.router.add_get('/{path:.*}', self.fixture)
+        app.on_cleanup.append(self.close)
+        return app
+
+    async def close(self, app):
+        if self.session is not None:
+            await self.session.close()
+
+    @web.middleware
+    async def simulate(self, request, handler):
+        self.counts['requests'] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.rate_limit is not None and request.path.startswith('/api'):
+            now = time()
+            while self.requests and now - self.requests[0] >= 60:
+                self.requests.popleft()
+            if len(self.requests) >= self.rate_limit:
+                retry_after = max(1, int(60 - (now - self.requests[0])))
+                self.counts['rate_limited'] += 1
+                return web.json_response({'error': 'Too Many Attempts.'}, status=429,
+                                         headers={'Retry-After': str(retry_after)})
+            self.requests.append(now)
+
+        if random.random() < self.error_rate:
+            self.counts['errors'] += 1
+            return web.json_response({'error': 'Internal Server Error'}, status=503)
+
+        return await handler(request)
+
+    async def token(self, request):
+        return web.json_response({
+            'token_type':       'Bearer',
+            'access_token':     'standin',
+            'refresh_token':    'standin',
+            'expires_in':       86400
+        })
+
+    async def submit(self, request):
+        form = await request.post()
+        self.submissions += 1
+        self.submissions_dir.mkdir(parents=True, exist_ok=True)
+        image = form['image']
+        path = self.submissions_dir / f'{self.submissions}{Path(image.filename).suffix}'
+        path.write_bytes(image.file.read())
+        (self.submissions_dir / f'{self.submissions}.txt').write_text(form['title'])
+        return web.json_response({'url': f'{request.url.origin()}/r/osugame/{self.submissions}'})
+
+    async def fixture(self, request):
+        path = request.match_info['path']
+        fixture = self.fixtures.find(path, request.query)
+        if fixture is not None:
+            body, content_type = self.fixtures.load(fixture)
+            if content_type is not None:
+                body = body.replace(b'{origin}', str(request.url.origin()).encode())
+            return web.Response(body=body, content_type=content_type or 'application/octet-stream')
+
+        if self.upstream is None:
+            return web.json_response({'error': None}, status=404)
+        return await self.record(request, path)
+
+    async def record(self, request, path):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+        headers = {key: value for key, value in request.headers.items() if key == 'Authorization'}
+        async with self.session.get(f'{self.upstream}/{path}', params=request.query,
+                                    headers=headers) as response:
+            body = await response.read()
+            status = response.status
+            content_type = response.content_type
+
+        if status == 200:
+            self.fixtures.record(path, request.query, body, content_type)
+        return web.Response(body=body, status=status, content_type=content_type)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-f', '--fixtures', type=Path, default=FIXTURES_DIR)
+    parser.add_argument('-l', '--latency', type=float, default=0)
+    parser.add_argument('-j', '--jitter', type=float, default=0)
+    parser.add_argument('-r', '--rate-limit', type=int)
+    parser.add_argument('-e', '--error-rate', type=float, default=0)
+    parser.add_argument('--record', metavar='UPSTREAM')
+    args = parser.parse_args()
+
+    server = StandInServer(Fixtures(args.fixtures), args.latency, args.jitter,
+                           args.rate_limit, args.error_rate, args.record)
+    web.run_app(server.application(), host='localhost', port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+import argparse
+import statistics
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+MODULES = ['utils', 'score', 'workers', 'post', 'results', 'interactive', 'tracker', 'batch']
+RUNS = 5
+
+
+def time_command(code, runs):
+    samples = []
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        samples.append(perf_counter() - start)
+    return statistics.median(samples)
+
+
+def load_workers():
+    import workers
+    return workers.__name__
+
+
+def time_worker_spawn(runs):
+    samples = []
+    for _ in range(runs):
+        start = perf_counter()
+        with ProcessPoolExecutor(1) as executor:
+            executor.submit(load_workers).result()
+        samples.append(perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('-n', '--runs', type=int, default=RUNS)
+    args = parser.parse_args()
+
+    baseline = time_command('pass', args.runs)
+    print(f"{'interpreter':<16}{baseline*1000:>8.1f} ms")
+    for module in args.modules:
+        elapsed = time_command(f'import {module}', args.runs) - baseline
+        print(f"{module:<16}{elapsed*1000:>8.1f} ms")
+    print(f"{'worker spawn':<16}{time_worker_spawn(args.runs)*1000:>8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import pytest
+from jobs import (ANALYSIS, DONE, FAILED, MAX_ATTEMPTS, PENDING, POST, RENDER,
+                  RUNNING, JobQueue)
+
+
+class FakeUploader:
+    workers = 1
+
+
+def make_queue(path):
+    return JobQueue(None, FakeUploader(), path=str(path))
+
+
+def make_play(score_id, user_id=1):
+    return {'id': score_id, 'user_id': user_id, 'created_at': '2026-10-19T00:00:00+00:00'}
+
+
+def state(queue, score_id):
+    return queue.db.execute('SELECT stage, state FROM jobs WHERE score_id = ?', (score_id,)).fetchone()
+
+
+def test_enqueue_is_idempotent(tmp_path):
+    queue = make_queue(tmp_path / 'jobs.db')
+    assert queue.enqueue(make_play(1), detected=10)
+    assert not queue.enqueue(make_play(1), detected=20)
+    assert queue.backlog() == {ANALYSIS: 1, RENDER: 0, POST: 0}
+
+
+def test_enqueue_moves_cursor_with_job(tmp_path):
+    queue = make_queue(tmp_path / 'jobs.db')
+    play = make_play(1)
+    queue.enqueue(play, detected=10, cursor=(1, play))
+
+    restarted = make_queue(tmp_path / 'jobs.db')
+    assert restarted.cursor(1) == play
+    assert state(restarted, 1) == (ANALYSIS, PENDING)
+
+
+def test_enqueue_rolls_back_job_when_cursor_fails(tmp_path):
+    queue = make_queue(tmp_path / 'jobs.db')
+    with pytest.raises(TypeError):
+        queue.enqueue(make_play(1), detected=10, cursor=(1, {'unserializable': object()}))
+
+    assert state(queue, 1) is None
+    assert queue.cursor(1) is None
+    assert queue.enqueue(make_play(1), detected=10)
+
+
+def test_claim_oldest_first(tmp_path):
+    queue = make_queue(tmp_path / 'jobs.db')
+    queue.enqueue(make_play(2), detected=20)
+    queue.enqueue(make_play(1), detected=10)
+
+    assert queue.claim(ANALYSIS).score_id == 1
+    assert queue.claim(ANALYSIS).score_id == 2
+    assert queue.claim(ANALYSIS) is None
+    assert state(queue, 1) == (ANALYSIS, RUNNING)
+
+
+def test_advance_through_stages(tmp_path):
+    queue = make_queue(tmp_path / 'jobs.db')
+    queue.enqueue(make_play(1), detected=10)
+
+    job = queue.claim(ANALYSIS)
+    queue.advance(job, RENDER, title='title', snapshot=b'snapshot')
+    job = queue.claim(RENDER)
+    assert (job.title, job.snapshot) == ('title', b'snapshot')
+    queue.advance(job, POST, image='image.png')
+    job = queue.claim(POST)
+    assert job.image == 'image.png'
+    queue.advance(job, DONE, url='https://redd.it/x')
+
+    assert state(queue, 1) == (DONE, DONE)
+    assert queue.backlog() == {ANALYSIS: 0, RENDER: 0, POST: 0}
+
+
+def test_fail_retries_until_max_attempts(tmp_path):
+    queue = make_queue(tmp_path / 'jobs.db')
+    queue.enqueue(make_play(1), detected=10)
+
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert queue.fail(queue.claim(ANALYSIS), ANALYSIS, 'error')
+        assert state(queue, 1) == (ANALYSIS, PENDING)
+    assert not queue.fail(queue.claim(ANALYSIS), ANALYSIS, 'error')
+    assert state(queue, 1) == (ANALYSIS, FAILED)
+    assert queue.claim(ANALYSIS) is None
+
+
+def test_fail_never_retries_posts(tmp_path):
+    queue = make_queue(tmp_path / 'jobs.db')
+    queue.enqueue(make_play(1), detected=10)
+    queue.advance(queue.claim(ANALYSIS), POST, image='image.png')
+
+    assert not queue.fail(queue.claim(POST), POST, 'error')
+    assert state(queue, 1) == (POST, FAILED)
+
+
+def test_recover_after_crash(tmp_path):
+    queue = make_queue(tmp_path / 'jobs.db')
+    for score_id in range(1, 5):
+        queue.enqueue(make_play(score_id), detected=score_id)
+
+    queue.claim(ANALYSIS)
+    queue.advance(queue.claim(ANALYSIS), RENDER, title='title', snapshot=b'snapshot')
+    queue.claim(RENDER)
+    queue.advance(queue.claim(ANALYSIS), RENDER, title='title')
+    queue.claim(RENDER)
+    queue.advance(queue.claim(ANALYSIS), POST, image='image.png')
+    queue.claim(POST)
+
+    restarted = make_queue(tmp_path / 'jobs.db')
+    restarted.recover()
+    assert state(restarted, 1) == (ANALYSIS, PENDING)
+    assert state(restarted, 2) == (RENDER, PENDING)
+    assert state(restarted, 3) == (ANALYSIS, PENDING)
+    assert state(restarted, 4) == (POST, FAILED)
+    error, = restarted.db.execute('SELECT error FROM jobs WHERE score_id = 4').fetchone()
+    assert error == 'interrupted while posting'
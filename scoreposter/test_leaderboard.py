@@ -0,0 +1,47 @@
+import asyncio
+
+from leaderboard import LeaderboardCache
+
+
+class FakeAPI:
+
+    def __init__(self):
+        self.requests = []
+
+    async def request(self, endpoint, parameters, priority):
+        self.requests.append((endpoint, parameters))
+        await asyncio.sleep(0.01)
+        return {'scores': [{'user_id': 2}, {'user_id': 1}, {'user_id': 2}]}
+
+
+def test_concurrent_gets_share_one_request():
+    async def run():
+        osu_api = FakeAPI()
+        cache = LeaderboardCache(osu_api)
+        first, second = await asyncio.gather(cache.get(1), cache.get(1))
+        assert first is second
+        assert first.find(2)[0] == 1
+        assert first.find(3) == (None, None)
+        assert len(osu_api.requests) == 1
+
+    asyncio.run(run())
+
+
+def test_stale_entries_are_refetched():
+    async def run():
+        osu_api = FakeAPI()
+        cache = LeaderboardCache(osu_api, ttl=60)
+        leaderboard = await cache.get(1, ['HD', 'DT'])
+        assert await cache.get(1, ['DT', 'HD']) is leaderboard
+        assert len(osu_api.requests) == 1
+
+        await cache.get(1, ['HD', 'DT'], since=leaderboard.fetched + 1)
+        assert len(osu_api.requests) == 2
+
+        cache.ttl = 0
+        cache.entries[cache.key(1, ['HD', 'DT'])].fetched -= 1
+        await cache.get(1, ['HD', 'DT'])
+        assert len(osu_api.requests) == 3
+        assert osu_api.requests[0][1] == [('mods[]', 'DT'), ('mods[]', 'HD')]
+
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+import asyncio
+
+from ratelimit import Priority, RateLimiter
+
+
+def test_reserves_capacity_for_higher_priorities(tmp_path):
+    limiter = RateLimiter(10, path=str(tmp_path / 'ratelimit.db'))
+    assert limiter.capacity(Priority.POST) == 10
+    assert limiter.capacity(Priority.POLL) == 8
+
+    for _ in range(8):
+        assert limiter._try_acquire(Priority.POLL) == 0
+    assert limiter._try_acquire(Priority.POLL) > 0
+    assert limiter._try_acquire(Priority.DEFAULT) == 0
+    assert limiter._try_acquire(Priority.POST) == 0
+    assert limiter._try_acquire(Priority.POST) > 0
+    assert limiter.current_rate() == 10
+
+
+def test_processes_share_the_window(tmp_path):
+    path = str(tmp_path / 'ratelimit.db')
+    first = RateLimiter(2, path=path)
+    second = RateLimiter(2, path=path)
+
+    asyncio.run(first.acquire(Priority.POST))
+    asyncio.run(second.acquire(Priority.POST))
+    assert first._try_acquire(Priority.POST) > 0
+    assert second.current_rate() == 2
+
+
+def test_window_expires(tmp_path):
+    limiter = RateLimiter(1, path=str(tmp_path / 'ratelimit.db'), window=0.05)
+    asyncio.run(limiter.acquire(Priority.POST))
+    asyncio.run(asyncio.wait_for(limiter.acquire(Priority.POST), 1))
+    assert limiter.current_rate() == 1
@@ -0,0 +1,45 @@
+from datetime import datetime, timezone
+
+from scheduler import (IDLE_INTERVAL, MIN_INTERVAL, ONLINE_INTERVAL,
+                       PlayerSchedule, PollScheduler)
+
+
+class FakePlayer:
+
+    def __init__(self, user_id, online=None):
+        self.user_id = user_id
+        self.online = online
+
+
+def play_at(timestamp, length=120):
+    created_at = datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+    return {'created_at': created_at, 'beatmap': {'total_length': length}}
+
+
+def test_idle_players_back_off():
+    schedule = PlayerSchedule()
+    assert schedule.interval(0) == IDLE_INTERVAL
+    assert schedule.interval(0, online=True) == ONLINE_INTERVAL
+    schedule.observe([])
+    schedule.observe([])
+    assert schedule.interval(0) == 4 * IDLE_INTERVAL
+
+
+def test_active_players_poll_near_next_play():
+    schedule = PlayerSchedule()
+    schedule.observe([play_at(1000)])
+    schedule.observe([play_at(1100)])
+
+    assert schedule.interval(1101) > MIN_INTERVAL
+    assert schedule.interval(1100 + schedule.cadence / 2) == MIN_INTERVAL
+
+
+def test_budget_scales_intervals():
+    players = [FakePlayer(user_id, online=True) for user_id in range(10)]
+    unlimited = PollScheduler(budget=10**6).next_polls(players, 0)
+    limited = PollScheduler(budget=30).next_polls(players, 0)
+
+    rate = len(players) * 60 / ONLINE_INTERVAL
+    for user_id, next_poll in unlimited.items():
+        assert next_poll == ONLINE_INTERVAL
+        assert limited[user_id] == ONLINE_INTERVAL * rate / 30
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+from score import Stage, run_stages
+
+
+class Pipeline:
+
+    def __init__(self):
+        self.order = []
+        self.threads = {}
+
+    async def load(self):
+        await asyncio.sleep(0.01)
+        self.order.append('load')
+
+    async def first(self):
+        self.order.append('first')
+        await asyncio.sleep(0.01)
+
+    async def second(self):
+        self.order.append('second')
+        await asyncio.sleep(0.01)
+
+    def compute(self):
+        self.threads['compute'] = threading.current_thread()
+        self.order.append('compute')
+
+    def finish(self):
+        self.order.append('finish')
+
+    async def fail(self):
+        raise RuntimeError("stage failed")
+
+    async def hang(self):
+        await asyncio.sleep(10)
+        self.order.append('hang')
+
+
+def test_stages_run_after_their_requirements():
+    pipeline = Pipeline()
+    stages = [Stage('finish', requires=('compute', 'second')),
+              Stage('compute', requires=('first',), executor=True),
+              Stage('second', requires=('load',)),
+              Stage('first', requires=('load',)),
+              Stage('load')]
+    asyncio.run(run_stages(pipeline, stages))
+
+    order = pipeline.order
+    assert order[0] == 'load' and order[-1] == 'finish'
+    assert order.index('first') < order.index('compute')
+    assert {'first', 'second'} == set(order[1:3])
+    assert pipeline.threads['compute'] is not threading.main_thread()
+
+
+def test_unknown_requirement():
+    with pytest.raises(ValueError):
+        asyncio.run(run_stages(Pipeline(), [Stage('finish', requires=('missing',))]))
+
+
+def test_failure_cancels_other_stages():
+    pipeline = Pipeline()
+    stages = [Stage('fail'), Stage('hang'), Stage('finish', requires=('fail',))]
+    with pytest.raises(RuntimeError):
+        asyncio.run(asyncio.wait_for(run_stages(pipeline, stages), 1))
+    assert pipeline.order == []
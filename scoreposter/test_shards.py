@@ -0,0 +1,87 @@
+import json
+
+import utils
+from shards import Coordinator, assign
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.messages = []
+
+    def write(self, data):
+        self.messages.append(json.loads(data))
+
+
+def make_coordinator(path, workers=()):
+    coordinator = Coordinator([1, 2, 3], path=str(path))
+    coordinator.workers = {worker: FakeWriter() for worker in workers}
+    return coordinator
+
+
+def enqueued(writer):
+    return [message['play']['id'] for message in writer.messages if message['type'] == 'enqueue']
+
+
+def test_assign_is_stable():
+    user_ids = list(range(100))
+    before = assign(user_ids, ['a', 'b'])
+    after = assign(user_ids, ['a', 'b', 'c'])
+
+    assert sorted(sum(after.values(), [])) == user_ids
+    for worker in ['a', 'b']:
+        assert set(after[worker]) <= set(before[worker])
+
+
+def test_claim_is_exclusive(tmp_path):
+    coordinator = make_coordinator(tmp_path / 'shards.db')
+    assert coordinator.claim('a', 10, 1, {'id': 10})
+    assert coordinator.claim('a', 10, 1, {'id': 10})
+    assert not coordinator.claim('b', 10, 1, {'id': 10})
+
+
+def test_lease_requires_unfinished_claim(tmp_path):
+    coordinator = make_coordinator(tmp_path / 'shards.db')
+    coordinator.claim('a', 10, 1, {'id': 10})
+
+    assert not coordinator.lease('b', 10)
+    assert coordinator.lease('a', 10)
+    coordinator.finish('a', 10)
+    assert not coordinator.lease('a', 10)
+
+
+def test_reassign_claims_of_lost_workers(tmp_path):
+    coordinator = make_coordinator(tmp_path / 'shards.db', ['b'])
+    coordinator.claim('a', 10, 1, {'id': 10})
+    coordinator.claim('a', 11, 1, {'id': 11})
+    coordinator.claim('a', 12, 1, {'id': 12})
+    coordinator.lease('a', 11)
+    coordinator.finish('a', 12)
+
+    coordinator.reassign({'b': [1, 2, 3]})
+    assert enqueued(coordinator.workers['b']) == [10]
+
+    assert not coordinator.lease('a', 10)
+    assert coordinator.claim('b', 10, 1, {'id': 10})
+    assert coordinator.lease('b', 10)
+
+
+def test_reassign_keeps_claims_of_connected_workers(tmp_path):
+    coordinator = make_coordinator(tmp_path / 'shards.db', ['a', 'b'])
+    coordinator.claim('a', 10, 1, {'id': 10})
+
+    coordinator.reassign({'b': [1, 2, 3]})
+    assert enqueued(coordinator.workers['b']) == []
+    assert coordinator.lease('a', 10)
+
+
+def test_rebalance_splits_budgets(tmp_path):
+    coordinator = make_coordinator(tmp_path / 'shards.db', ['a', 'b'])
+    coordinator.budget = 600
+    coordinator.rebalance()
+
+    assignments = [coordinator.workers[worker].messages[-1] for worker in ['a', 'b']]
+    assert sorted(sum((message['user_ids'] for message in assignments), [])) == [1, 2, 3]
+    for message in assignments:
+        assert message['budget'] == 300
+        assert message['rate_limit'] == (utils.OSU_RATE_LIMIT - 1) // 2
@@ -0,0 +1,76 @@
+import pickle
+
+from osrparse.enums import Mod
+from score import Rank
+from snapshot import ScoreSnapshot
+
+
+def make_snapshot(**changes):
+    fields = {
+        'player':       'WhiteCat',
+        'artist':       'xi',
+        'title':        'FREEDOM DiVE',
+        'difficulty':   'FOUR DIMENSIONS',
+        'mapper':       'Nakagawa-Kanon',
+        'stars':        7.63,
+        'mods':         {Mod.Hidden, Mod.HardRock},
+        'accuracy':     99.12,
+        'misses':       0,
+        'sliderbreaks': 1,
+        'combo':        2380,
+        'max_combo':    2385,
+        'hits':         (1932, 12, 0, 0),
+        'rank':         Rank.S_PLUS,
+        'ranking':      3,
+        'loved':        False,
+        'ranked':       True,
+        'submitted':    True,
+        'pp':           893.4,
+        'fcpp':         901.2,
+        'ur':           71.3,
+        'avatar_url':   'https://a.ppy.sh/4504101',
+        'global_rank':  2,
+        'country_rank': 1,
+        'country_code': 'DE',
+        'bg_path':      None,
+        'bg_url':       'https://assets.ppy.sh/beatmaps/39804/covers/cover@2x.jpg'
+    }
+    return ScoreSnapshot(**{**fields, **changes})
+
+
+def assert_round_trip(snapshot):
+    decoded = ScoreSnapshot.from_bytes(snapshot.to_bytes())
+    assert decoded == snapshot
+    assert decoded.fields() == snapshot.fields()
+    assert pickle.loads(pickle.dumps(snapshot)) == snapshot
+
+
+def test_round_trip():
+    assert_round_trip(make_snapshot())
+
+
+def test_missing_values():
+    snapshot = make_snapshot(pp=None, fcpp=None, ur=None, ranking=None, global_rank=None,
+                             country_rank=None, avatar_url=None, country_code=None, bg_url=None,
+                             submitted=False, ranked=False)
+    assert_round_trip(snapshot)
+    decoded = ScoreSnapshot.from_bytes(snapshot.to_bytes())
+    assert decoded.pp is None and decoded.ur is None
+    assert decoded.ranking is None and decoded.global_rank is None
+
+
+def test_combined_mods():
+    snapshot = make_snapshot(mods={Mod.Hidden, Mod.Nightcore})
+    assert_round_trip(snapshot)
+    assert ScoreSnapshot.from_bytes(snapshot.to_bytes()).mods == {Mod.Hidden, Mod.Nightcore}
+
+    assert_round_trip(make_snapshot(mods=set()))
+    assert_round_trip(make_snapshot(mods={Mod.Hidden, Mod.DoubleTime, Mod.HardRock, Mod.Flashlight}))
+
+
+def test_non_ascii_strings():
+    snapshot = make_snapshot(artist='ゆある', title='夜明けまであと３秒', difficulty='Ödipus',
+                             player='Ⓢⓚⓨ', mapper='Ämi')
+    assert_round_trip(snapshot)
+    decoded = pickle.loads(pickle.dumps(snapshot))
+    assert decoded.artist == 'ゆある' and decoded.title == '夜明けまであと３秒'
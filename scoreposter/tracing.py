@@ -0,0 +1,205 @@
+import asyncio
+import atexit
+import json
+import os
+import threading
+import weakref
+from collections import defaultdict
+from contextvars import ContextVar, copy_context
+from functools import partial
+from itertools import count
+from pathlib import Path
+from time import perf_counter_ns
+
+TRACE_ENV = 'SCOREPOSTER_TRACE'
+TRACE_PARENT_ENV = 'SCOREPOSTER_TRACE_PARENT'
+CHROME = 'chrome'
+COLLAPSED = 'collapsed'
+COLLAPSED_SUFFIXES = ['.folded', '.collapsed', '.txt']
+FLUSH_EVENTS = 1000
+
+current = ContextVar('span', default=None)
+tracer = None
+
+
+class NoSpan:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+class Span:
+
+    __slots__ = ('tracer', 'name', 'args', 'parent', 'start', 'children', 'token')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.parent = None
+        self.start = None
+        self.children = 0
+        self.token = None
+
+    def __enter__(self):
+        self.parent = current.get()
+        self.token = current.set(self)
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter_ns()
+        current.reset(self.token)
+        self.tracer.record(self, end)
+        return False
+
+    def stack(self):
+        names = []
+        span = self
+        while span is not None:
+            names.append(span.name.replace(';', ':'))
+            span = span.parent
+        return ';'.join(reversed(names))
+
+
+class Tracer:
+
+    def __init__(self, path, format=None):
+        self.template = str(path)
+        self.path = Path(self.template.format(pid=os.getpid()))
+        if format is None:
+            format = COLLAPSED if self.path.suffix in COLLAPSED_SUFFIXES else CHROME
+        self.format = format
+        self.pid = os.getpid()
+        self.origin = perf_counter_ns()
+        self.lock = threading.Lock()
+        self.events = []
+        self.stacks = defaultdict(int)
+        self.recorded = 0
+        self.started = False
+        self.threads = set()
+        self.tasks = weakref.WeakKeyDictionary()
+        self.task_ids = count(1)
+
+    def name_thread(self, tid, name):
+        self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                            'args': {'name': name}})
+
+    def thread(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            tid = threading.get_ident()
+            if tid not in self.threads:
+                self.threads.add(tid)
+                self.name_thread(tid, threading.current_thread().name)
+        else:
+            tid = self.tasks.get(task)
+            if tid is None:
+                tid = self.tasks[task] = -next(self.task_ids)
+                self.name_thread(tid, task.get_name())
+        return tid
+
+    def record(self, span, end):
+        duration = end - span.start
+        with self.lock:
+            if span.parent is not None:
+                span.parent.children += duration
+            if self.format == COLLAPSED:
+                self.stacks[span.stack()] += max(0, duration - span.children)
+            else:
+                event = {'name': span.name, 'ph': 'X', 'pid': self.pid, 'tid': self.thread(),
+                         'ts': (span.start - self.origin) / 1000, 'dur': duration / 1000}
+                if span.args:
+                    event['args'] = span.args
+                self.events.append(event)
+            self.recorded += 1
+            if self.recorded % FLUSH_EVENTS == 0:
+                self.flush()
+
+    def flush(self):
+        if not self.events and not self.stacks:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.format == COLLAPSED:
+            lines = [f'{stack} {duration // 1000}\n' for stack, duration in sorted(self.stacks.items())]
+            partial = self.path.with_name(self.path.name + '.part')
+            partial.write_text(''.join(lines))
+            os.replace(partial, self.path)
+            return
+        with open(self.path, 'a' if self.started else 'w') as file:
+            for event in self.events:
+                file.write((',\n' if self.started else '[\n') + json.dumps(event, default=str))
+                self.started = True
+        self.events = []
+
+    def write(self):
+        with self.lock:
+            self.flush()
+            if self.started:
+                with open(self.path, 'a') as file:
+                    file.write('\n]\n')
+                self.started = False
+
+
+def span(name, **args):
+    if tracer is None:
+        return NO_SPAN
+    return Span(tracer, name, args)
+
+
+def bind(func, *args):
+    if tracer is None:
+        return partial(func, *args) if args else func
+    return partial(copy_context().run, func, *args)
+
+
+def child_path(path):
+    if '{pid}' in path:
+        return path
+    path = Path(path)
+    return str(path.with_name(f'{path.stem}-{{pid}}{path.suffix}'))
+
+
+def export():
+    os.environ[TRACE_ENV] = tracer.template
+    os.environ[TRACE_PARENT_ENV] = str(tracer.pid)
+
+
+def write():
+    if tracer is not None:
+        tracer.write()
+
+
+def forked():
+    global tracer
+    tracer = None
+
+
+def enable(path, format=None):
+    global tracer
+    if tracer is not None:
+        return tracer
+    tracer = Tracer(path, format)
+    export()
+    atexit.register(write)
+    return tracer
+
+
+os.register_at_fork(after_in_child=forked)
+
+if os.environ.get(TRACE_ENV):
+    if os.environ.get(TRACE_PARENT_ENV, str(os.getpid())) != str(os.getpid()):
+        enable(child_path(os.environ[TRACE_ENV]))
+    else:
+        enable(os.environ[TRACE_ENV])
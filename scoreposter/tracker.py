@@ -3,50 +3,79 @@
 import argparse
 import asyncio
 from datetime import datetime, timedelta
+from time import time
 
+import metrics
+import tracing
 import utils
-from interactive import run_interactive_mode
+from interactive import PREFETCH, Session
+from jobs import JobQueue
 from post import Post, PostOptions
 from pytz import timezone
+from scheduler import PollScheduler
 from score import Score
+from uploader import UPLOAD_WORKERS, Uploader
+from workers import AnalysisPool
 
 EST = timezone('US/Eastern')
 
 
+ACTIVE_WINDOW = timedelta(minutes=30)
+RECENT_LIMIT = 10
+BULK_USERS_LIMIT = 50
+ACTIVITY_INTERVAL = 60
+POLL_BUDGET = utils.OSU_RATE_LIMIT // 2
+ITER_INTERVAL = 0.25
+
+
+def is_recent(timestamp):
+    if timestamp is None:
+        return False
+    return datetime.now(EST) - datetime.fromisoformat(timestamp) <= ACTIVE_WINDOW
+
+
 class Player:
 
-    def __init__(self, user_id, osu_api):
+    def __init__(self, user_id, osu_api, pool=None, jobs=None, uploader=None):
         self.user_id = user_id
         self.osu_api = osu_api
+        self.pool = pool
+        self.jobs = jobs
+        self.uploader = uploader
+        self.username = str(user_id)
         self.tracking = False
+        self.online = None
+        self.initialized = False
+        self.latest_play = None
+        self.last_posted = None
+        self.posts = set()
+        if jobs is not None:
+            cursor = jobs.cursor(user_id)
+            if cursor is not None:
+                self.latest_play = cursor
+                self.last_posted = cursor
+                self.initialized = True
 
-    async def is_active(self):
+    async def get_recent_plays(self):
         endpoint = f'users/{self.user_id}/scores/recent'
-        parameters = {'include_fails': 1, 'limit': 1}
-        data = await self.osu_api.request(endpoint, parameters)
-        if not isinstance(data, list) or len(data) != 1:
-            return False
-        self.username = data[0]['user']['username']
-        timestamp = datetime.fromisoformat(data[0]['created_at'])
-        if datetime.now(EST) - timestamp > timedelta(minutes=30):
-            return False
-        return True
-
-    async def get_latest_play(self):
-        endpoint = f'users/{self.user_id}/scores/recent'
-        parameters = {'limit': 1}
-        data = await self.osu_api.request(endpoint, parameters)
-        if not isinstance(data, list) or len(data) != 1:
+        parameters = {'include_fails': 1, 'limit': RECENT_LIMIT}
+        data = await self.osu_api.request(endpoint, parameters, priority=utils.Priority.POLL)
+        if not isinstance(data, list):
             return None
-        return data[0]
+        return data
 
     async def iter_plays(self):
-        latest_play = await self.get_latest_play()
+        plays = await self.get_recent_plays() or []
+        latest_play = next((play for play in plays if play['passed']), None)
         last_yielded = latest_play
         while True:
-            await asyncio.sleep(0.25)
+            await asyncio.sleep(ITER_INTERVAL)
             try:
-                new_play = await self.get_latest_play()
+                plays = await self.get_recent_plays()
+                if plays is None:
+                    continue
+
+                new_play = next((play for play in plays if play['passed']), None)
                 if new_play is None or new_play == latest_play or \
                    last_yielded is not None and last_yielded['id'] == new_play['id']:
                     continue
@@ -60,46 +89,177 @@ class Player:
                 import traceback
                 traceback.print_exc()
 
+    def update(self, plays):
+        if len(plays) > 0:
+            self.username = plays[0]['user']['username']
+        self.tracking = len(plays) > 0 and is_recent(plays[0]['created_at'])
+
+        passes = [play for play in plays if play['passed']]
+        new_play = passes[0] if passes else None
+        if not self.initialized:
+            self.latest_play = new_play
+            self.last_posted = new_play
+            self.initialized = True
+            if self.jobs is not None and new_play is not None:
+                self.jobs.checkpoint(self.user_id, new_play)
+            return
+
+        if new_play is None or new_play == self.latest_play or \
+           self.last_posted is not None and self.last_posted['id'] == new_play['id']:
+            return
+
+        if self.jobs is None:
+            new_plays = [new_play]
+        else:
+            new_plays = [play for play in reversed(passes) if self.is_new(play)]
+
+        for play in new_plays:
+            self.latest_play = play
+            if play['pp'] is None or play['pp'] < 700 or not play['replay']:
+                if self.jobs is not None:
+                    self.jobs.checkpoint(self.user_id, play)
+                continue
+
+            self.last_posted = play
+            detected = time()
+            played = datetime.fromisoformat(play['created_at']).timestamp()
+            metrics.DETECTION_LATENCY.observe(max(0, detected - played))
+            if self.jobs is not None:
+                self.jobs.enqueue(play, detected, cursor=(self.user_id, play))
+            else:
+                task = asyncio.create_task(self.post(play, detected))
+                self.posts.add(task)
+                task.add_done_callback(self.posts.discard)
+
+    def is_new(self, play):
+        if self.latest_play is None:
+            return True
+        if play['id'] == self.latest_play['id']:
+            return False
+        return datetime.fromisoformat(play['created_at']) > datetime.fromisoformat(self.latest_play['created_at'])
+
+    async def post(self, play, detected):
+        try:
+            score = await Score.from_submission(play, self.osu_api, self.pool)
+            options = PostOptions(show_combo=False)
+            post = Post(score, options)
+            url = await post.upload(self.uploader)
+            metrics.POST_LATENCY.observe(time() - detected)
+            print(post.title)
+            print(url)
+
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
+
+class Poller:
+
+    def __init__(self, players, osu_api, budget=POLL_BUDGET):
+        self.players = {player.user_id: player for player in players}
+        self.osu_api = osu_api
+        self.scheduler = PollScheduler(budget)
+        self.inflight = set()
+        self.tasks = set()
+        self.wakeup = asyncio.Event()
+
+    async def refresh_activity(self):
+        user_ids = list(self.players)
+        for start in range(0, len(user_ids), BULK_USERS_LIMIT):
+            chunk = user_ids[start:start + BULK_USERS_LIMIT]
+            parameters = [('ids[]', user_id) for user_id in chunk]
+            data = await self.osu_api.request('users', parameters, priority=utils.Priority.POLL)
+            if not isinstance(data, dict) or 'users' not in data:
+                continue
+
+            for user in data['users']:
+                player = self.players.get(user['id'])
+                if player is None:
+                    continue
+                player.username = user['username']
+                if user.get('is_online'):
+                    player.online = True
+                elif user.get('last_visit') is not None:
+                    player.online = is_recent(user['last_visit'])
+                else:
+                    player.online = None
+
+    async def poll(self, player):
+        try:
+            plays = await player.get_recent_plays()
+            if plays is not None:
+                self.scheduler.schedule(player.user_id).observe(plays)
+                player.update(plays)
+
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
+        finally:
+            self.inflight.discard(player.user_id)
+            self.wakeup.set()
+
+    def start_poll(self, player):
+        self.scheduler.schedule(player.user_id).last_polled = time()
+        self.inflight.add(player.user_id)
+        task = asyncio.create_task(self.poll(player))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
     async def loop(self):
-        latest_play = await self.get_latest_play()
-        last_posted = latest_play
+        next_refresh = 0
         while True:
-            await asyncio.sleep(1)
             try:
-                self.tracking = await self.is_active()
-                if not self.tracking:
-                    await asyncio.sleep(60)
-                    continue
+                now = time()
+                if now >= next_refresh:
+                    next_refresh = now + ACTIVITY_INTERVAL
+                    await self.refresh_activity()
 
-                new_play = await self.get_latest_play()
-                if new_play is None or new_play == latest_play or \
-                   last_posted is not None and last_posted['id'] == new_play['id']:
-                    continue
+                now = time()
+                idle = [player for user_id, player in self.players.items()
+                        if user_id not in self.inflight]
+                next_polls = self.scheduler.next_polls(idle, now)
+                for user_id, next_poll in next_polls.items():
+                    if next_poll <= now:
+                        self.start_poll(self.players[user_id])
 
-                latest_play = new_play
-                if latest_play['pp'] is not None and latest_play['pp'] >= 700 and latest_play['replay']:
-                    last_posted = latest_play
-                    score = Score.from_submission(latest_play, self.osu_api)
-                    options = PostOptions(show_combo=False)
-                    post = Post(score, options)
-                    post.submit()
-                    print(post.title)
+                waiting = [next_poll for next_poll in next_polls.values() if next_poll > now]
+                timeout = min(waiting + [next_refresh]) - now
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    pass
 
             except Exception:
                 import traceback
                 traceback.print_exc()
+                await asyncio.sleep(ACTIVITY_INTERVAL)
 
 
 class Tracker:
 
-    def __init__(self, user_ids, osu_api):
+    def __init__(self, user_ids, osu_api, pool=None, budget=POLL_BUDGET, jobs=None):
         self.osu_api = osu_api
-        self.players = [Player(user_id, self.osu_api) for user_id in user_ids]
+        self.pool = pool
+        self.jobs = jobs
+        self.uploader = jobs.uploader if jobs is not None else None
+        self.players = [Player(user_id, self.osu_api, self.pool, self.jobs, self.uploader)
+                        for user_id in user_ids]
+        self.poller = Poller(self.players, self.osu_api, budget)
         event_loop = asyncio.get_event_loop()
-        for player in self.players:
-            event_loop.create_task(player.loop())
+        if self.jobs is not None:
+            event_loop.create_task(self.jobs.run())
+        event_loop.create_task(self.poller.loop())
         event_loop.create_task(self.tracking_status())
 
+    def assign(self, user_ids):
+        players = {player.user_id: player for player in self.players}
+        self.players = [players.get(user_id) or Player(user_id, self.osu_api, self.pool, self.jobs, self.uploader)
+                        for user_id in user_ids]
+        self.poller.players = {player.user_id: player for player in self.players}
+        self.poller.wakeup.set()
+
     async def tracking_status(self):
         await asyncio.sleep(10)
         while True:
@@ -108,40 +268,79 @@ class Tracker:
             rate = self.osu_api.get_current_rate()
             if rate is not None:
                 print(f"API call load: {rate:.0f}/{utils.OSU_RATE_LIMIT} per minute")
+            if self.jobs is not None:
+                backlog = ", ".join(f"{stage}: {count}" for stage, count in self.jobs.backlog().items())
+                print(f"Job queue: {backlog}")
             await asyncio.sleep(300)
 
     @classmethod
-    def track(cls, user_ids):
+    def track(cls, user_ids, workers=None, budget=POLL_BUDGET, metrics_port=None,
+              stage_workers=(2, 1, UPLOAD_WORKERS), renderer=None):
+        analysis_workers, render_workers, post_workers = stage_workers
+
         async def track_async(cls, user_ids):
-            async with utils.OsuAPI(mode=utils.OsuAuthenticationMode.AUTHORIZATION_CODE) as osu_api:
-                cls(user_ids, osu_api)
+            if metrics_port is not None:
+                await metrics.serve(metrics_port)
+            async with utils.OsuAPI(mode=utils.OsuAuthenticationMode.AUTHORIZATION_CODE) as osu_api, \
+                       AnalysisPool(workers) as pool, \
+                       Uploader(post_workers) as uploader:
+                jobs = JobQueue(osu_api, uploader, pool, analysis_workers=analysis_workers,
+                                render_workers=render_workers, renderer=renderer)
+                cls(user_ids, osu_api, pool, budget, jobs)
                 await asyncio.gather(*asyncio.all_tasks())
 
         asyncio.run(track_async(cls, user_ids))
 
 
-async def loop_plays(user_id=None, username=None):
-    async with utils.OsuAPI(mode=utils.OsuAuthenticationMode.AUTHORIZATION_CODE) as osu_api:
+async def loop_plays(user_id=None, username=None, workers=None, prefetch=PREFETCH):
+    async with utils.OsuAPI(mode=utils.OsuAuthenticationMode.AUTHORIZATION_CODE) as osu_api, \
+               AnalysisPool(workers) as pool:
         print("Awaiting replays.")
         if user_id is None:
             user_id = await osu_api.username_to_id(username)
-        player = Player(user_id, osu_api)
-        async for submission in player.iter_plays():
-            print("Replay found!")
-            await run_interactive_mode(PostOptions(), osu_api, submission=submission)
+        player = Player(user_id, osu_api, pool)
+        async with Session(osu_api, PostOptions(), pool, prefetch) as session:
+
+            async def feed():
+                async for submission in player.iter_plays():
+                    print("Replay found!")
+                    session.add(submission=submission)
+
+            feeder = asyncio.create_task(feed())
+            try:
+                await session.run()
+            finally:
+                feeder.cancel()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--id', type=int)
     parser.add_argument('--username', type=str)
+    parser.add_argument('-w', '--workers', type=int)
+    parser.add_argument('-b', '--budget', type=int, default=POLL_BUDGET)
+    parser.add_argument('-m', '--metrics-port', type=int)
+    parser.add_argument('--analysis-workers', type=int, default=2)
+    parser.add_argument('--render-workers', type=int, default=1)
+    parser.add_argument('--post-workers', type=int, default=UPLOAD_WORKERS)
+    parser.add_argument('--render-farm', type=str)
+    parser.add_argument('--trace', type=str)
     args = parser.parse_args()
 
+    if args.trace is not None:
+        tracing.enable(args.trace)
+
     if args.id is not None:
-        asyncio.run(loop_plays(user_id=args.id))
+        asyncio.run(loop_plays(user_id=args.id, workers=args.workers))
     elif args.username is not None:
-        asyncio.run(loop_plays(username=args.username))
+        asyncio.run(loop_plays(username=args.username, workers=args.workers))
     else:
         with open(utils.WHITELIST_PATH) as whitelist:
             user_ids = [int(line) for line in whitelist.readlines()]
-        Tracker.track(user_ids)
+        stage_workers = (args.analysis_workers, args.render_workers, args.post_workers)
+        renderer = None
+        if args.render_farm is not None:
+            from render_farm import (BALANCER_PORT, RemoteRenderer,
+                                     parse_address)
+            renderer = RemoteRenderer(*parse_address(args.render_farm, BALANCER_PORT))
+        Tracker.track(user_ids, args.workers, args.budget, args.metrics_port, stage_workers, renderer)
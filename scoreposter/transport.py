@@ -0,0 +1,73 @@
+import asyncio
+import random
+from email.utils import parsedate_to_datetime
+from time import time
+
+import aiohttp
+
+CONNECTION_LIMIT = 100
+HOST_CONNECTION_LIMIT = 20
+DNS_CACHE_TTL = 5*60
+KEEPALIVE_TIMEOUT = 30
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=10, sock_read=30)
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryableStatus(Exception):
+
+    def __init__(self, url, status, delay=None):
+        super().__init__(f"{url} returned status {status}")
+        self.url = url
+        self.status = status
+        self.delay = delay
+
+
+def create_session(**kwargs):
+    connector = aiohttp.TCPConnector(limit=CONNECTION_LIMIT,
+                                     limit_per_host=HOST_CONNECTION_LIMIT,
+                                     ttl_dns_cache=DNS_CACHE_TTL,
+                                     keepalive_timeout=KEEPALIVE_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT, **kwargs)
+
+
+def retry_after(headers):
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+def check_status(response):
+    if response.status in RETRY_STATUSES:
+        raise RetryableStatus(response.url, response.status, retry_after(response.headers))
+
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+async def retry(func, before=None, retries=MAX_RETRIES):
+    for attempt in range(retries + 1):
+        if before is not None:
+            await before()
+        try:
+            return await func()
+        except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus) as e:
+            if isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES:
+                raise
+            if attempt == retries:
+                raise
+            delay = backoff(attempt)
+            if isinstance(e, RetryableStatus) and e.delay is not None:
+                delay += e.delay
+            await asyncio.sleep(delay)
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+import utils
+from transport import backoff, retry_after
+
+UPLOAD_WORKERS = 2
+UPLOAD_RETRIES = 4
+RATE_LIMIT_PATTERN = re.compile(r'(\d+) (millisecond|second|minute)')
+RATE_LIMIT_UNITS = {'millisecond': 0.001, 'second': 1, 'minute': 60}
+
+
+def rate_limit_delay(error):
+    for item in getattr(error, 'items', None) or []:
+        if getattr(item, 'error_type', None) == 'RATELIMIT':
+            match = RATE_LIMIT_PATTERN.search(item.message or '')
+            if match is None:
+                return 60
+            amount, unit = match.groups()
+            return int(amount) * RATE_LIMIT_UNITS[unit]
+
+    response = getattr(error, 'response', None)
+    if response is not None and getattr(response, 'status_code', None) == 429:
+        return retry_after(response.headers) or 0
+    return None
+
+
+def write_image(image):
+    fd, path = tempfile.mkstemp(suffix='.png')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(image)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def post_url(submission):
+    if isinstance(submission, str):
+        return submission
+    return submission.shortlink
+
+
+class Uploader:
+
+    def __init__(self, workers=UPLOAD_WORKERS, retries=UPLOAD_RETRIES):
+        self.workers = workers
+        self.retries = retries
+        self.executor = None
+        self.semaphore = None
+        self.tasks = set()
+
+    async def __aenter__(self):
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='upload')
+        self.semaphore = asyncio.Semaphore(self.workers)
+        return self
+
+    async def __aexit__(self, *args):
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown()
+
+    def submit_image(self, title, path):
+        return post_url(utils.get_subreddit().submit_image(title, path))
+
+    async def upload(self, title, image, callback=None):
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            path = await asyncio.to_thread(write_image, image)
+            try:
+                for attempt in range(self.retries + 1):
+                    try:
+                        with tracing.span('reddit submit', attempt=attempt, size=len(image)):
+                            url = await loop.run_in_executor(self.executor,
+                                                             tracing.bind(self.submit_image, title, path))
+                        break
+                    except Exception as e:
+                        delay = rate_limit_delay(e)
+                        if delay is None or attempt == self.retries:
+                            raise
+                        with tracing.span('rate limit backoff'):
+                            await asyncio.sleep(delay + backoff(attempt))
+            finally:
+                os.unlink(path)
+
+        if callback is not None:
+            callback(title, url)
+        return url
+
+    def post(self, title, image, callback=None):
+        task = asyncio.create_task(self.upload(title, image, callback))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
@@ -1,56 +1,121 @@
-import asyncio
 import json
-import sqlite3
-import webbrowser
 from collections import OrderedDict
 from enum import Enum
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from functools import cache
 from pathlib import Path
-from time import time
-from urllib.parse import parse_qs, urlparse
-
-import aiofiles
-import aiohttp
-import numpy as np
-import praw
-import requests
-from circleguard import Circleguard
+from time import perf_counter
+
+import metrics
+import tracing
+from auth import OsuAuth, OsuAuthenticationMode
+from downloads import DownloadCache
+from leaderboard import LeaderboardCache
 from osrparse.enums import Mod
+from ratelimit import Priority, RateLimiter
+from responses import ResponseCache
+from transport import check_status, create_session, retry
 
 KEYS_PATH = 'keys.json'
 CONFIG_PATH = 'config.json'
-DB_PATH = 'cache.db'
 WHITELIST_PATH = 'players.list'
 
-OSU_URL = 'https://osu.ppy.sh'
-V1_URL = f'{OSU_URL}/api'
-V2_URL = f'{V1_URL}/v2'
+DEFAULT_OSU_URL = 'https://osu.ppy.sh'
 OSU_RATE_LIMIT = 1200
+USER_AGENT = 'windows:scoreposter:v1.1.0 (by /u/notjagan)'
+
+
+@cache
+def get_keys():
+    with open(KEYS_PATH) as file:
+        return json.load(file)
+
+
+@cache
+def get_config():
+    with open(CONFIG_PATH) as file:
+        return json.load(file)
+
+
+def osu_url():
+    return get_config().get('osu_url', DEFAULT_OSU_URL)
+
+
+def v1_url():
+    return f'{osu_url()}/api'
+
+
+def v2_url():
+    return f'{v1_url()}/v2'
+
+
+@cache
+def get_cg():
+    from circleguard import Circleguard
+    return Circleguard(get_keys()['osu_key'])
+
+
+@cache
+def get_reddit():
+    import praw
+    keys = get_keys()
+    reddit = praw.Reddit(client_id=keys['reddit_id'],
+                         client_secret=keys['reddit_secret'],
+                         username=keys['username'],
+                         password=keys['password'],
+                         user_agent=USER_AGENT)
+    reddit.validate_on_submit = True
+    return reddit
+
+
+@cache
+def get_subreddit():
+    reddit_url = get_config().get('reddit_url')
+    if reddit_url is not None:
+        from standin import StandInSubreddit
+        return StandInSubreddit(reddit_url)
+    return get_reddit().subreddit("osugame")
+
+
+@cache
+def get_limiter():
+    return RateLimiter(OSU_RATE_LIMIT - 1)
+
+
+metrics.API_RATE.func = lambda: get_limiter().current_rate()
+
+
+@cache
+def get_beatmaps():
+    from beatmaps import BeatmapStore
+    return BeatmapStore(get_config()['beatmaps_dir'])
+
+
+LAZY_ATTRIBUTES = {
+    'OSU_API_KEY':          lambda: get_keys()['osu_key'],
+    'OSU_CLIENT_ID':        lambda: get_keys()['osu_id'],
+    'OSU_CLIENT_SECRET':    lambda: get_keys()['osu_secret'],
+    'REDDIT_CLIENT_ID':     lambda: get_keys()['reddit_id'],
+    'REDDIT_CLIENT_SECRET': lambda: get_keys()['reddit_secret'],
+    'REDDIT_USERNAME':      lambda: get_keys()['username'],
+    'REDDIT_PASSWORD':      lambda: get_keys()['password'],
+    'OSU_PATH':             lambda: Path(get_config()['osu_path']),
+    'BEATMAPS_DIR':         lambda: Path(get_config()['beatmaps_dir']),
+    'REDDIT_URL':           lambda: get_config().get('reddit_url'),
+    'OSU_URL':              osu_url,
+    'V1_URL':               v1_url,
+    'V2_URL':               v2_url,
+    'cg':                   get_cg,
+    'reddit':               get_reddit,
+    'subreddit':            get_subreddit,
+    'beatmaps':             get_beatmaps
+}
+
+
+def __getattr__(name):
+    if name in LAZY_ATTRIBUTES:
+        return LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-with open(KEYS_PATH) as file:
-    data = json.load(file)
-OSU_API_KEY = data['osu_key']
-OSU_CLIENT_ID = data['osu_id']
-OSU_CLIENT_SECRET = data['osu_secret']
-REDDIT_CLIENT_ID = data['reddit_id']
-REDDIT_CLIENT_SECRET = data['reddit_secret']
-REDDIT_USERNAME = data['username']
-REDDIT_PASSWORD = data['password']
-
-cg = Circleguard(OSU_API_KEY)
-reddit = praw.Reddit(client_id=REDDIT_CLIENT_ID,
-                     client_secret=REDDIT_CLIENT_SECRET,
-                     username=REDDIT_USERNAME,
-                     password=REDDIT_PASSWORD,
-                     user_agent='windows:scoreposter:v1.1.0 (by /u/notjagan)')
-reddit.validate_on_submit = True
-subreddit = reddit.subreddit("osugame")
-osu_db = sqlite3.connect(DB_PATH)
-
-with open(CONFIG_PATH) as file:
-    data = json.load(file)
-OSU_PATH = Path(data['osu_path'])
-BEATMAPS_DIR = Path(data['beatmaps_dir'])
 
 MODS = OrderedDict([(Mod.Easy,          "EZ"),
                     (Mod.NoFail,        "NF"),
@@ -69,149 +134,118 @@ class OsuAPIVersion(Enum):
     V2 = 2
 
 
-class OsuAuthenticationMode(Enum):
-    CLIENT_CREDENTIALS = 1
-    AUTHORIZATION_CODE = 2
+RESPONSE_TTLS = [(OsuAPIVersion.V2, r'beatmaps/\d+',       6*60*60),
+                 (OsuAPIVersion.V2, r'users/\d+/osu',      5*60),
+                 (OsuAPIVersion.V2, r'scores/osu/\d+',     24*60*60),
+                 (OsuAPIVersion.V1, r'get_beatmaps',       6*60*60),
+                 (OsuAPIVersion.V1, r'get_user',           60*60)]
 
 
 class OsuAPI:
 
-    def __init__(self, key=OSU_API_KEY, client_id=OSU_CLIENT_ID, client_secret=OSU_CLIENT_SECRET,
+    def __init__(self, key=None, client_id=None, client_secret=None,
                  mode=OsuAuthenticationMode.CLIENT_CREDENTIALS):
-        self.key = key
-        self.client_id = client_id
-        self.client_secret = client_secret
-        self.headers = self._headers(mode)
-        self.times = np.full(OSU_RATE_LIMIT - 1, -np.inf)
-        self.index = 0
+        keys = get_keys() if None in (key, client_id, client_secret) else {}
+        self.key = key or keys['osu_key']
+        self.client_id = client_id or keys['osu_id']
+        self.client_secret = client_secret or keys['osu_secret']
+        self.auth = OsuAuth(self.client_id, self.client_secret, mode, f'{osu_url()}/oauth')
+        self.limiter = get_limiter()
+        self.leaderboards = LeaderboardCache(self)
+        self.downloads = DownloadCache()
+        self.responses = ResponseCache(RESPONSE_TTLS)
 
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        self.session = create_session()
+        await self.auth.start(self.session)
         return self
 
     async def __aexit__(self, *args):
+        await self.auth.stop()
         await self.session.close()
         self.session = None
 
-    def _headers(self, mode):
-        endpoint = f'{OSU_URL}/oauth/token'
-        payload = {
-            'client_id':        self.client_id,
-            'client_secret':    self.client_secret,
-            'grant_type':       'client_credentials',
-            'scope':            'public',
-        }
+    @property
+    def headers(self):
+        return self.auth.headers
 
-        if mode is OsuAuthenticationMode.AUTHORIZATION_CODE:
-            endpoint_2 = f'{OSU_URL}/oauth/authorize'
-            params = {
-                'client_id':        self.client_id,
-                'scope':            'public',
-                'response_type':    'code',
-                'redirect_uri':     'http://localhost:7270'
-            }
-            request = requests.Request('GET', url=endpoint_2, params=params)
-            url = request.prepare().url
-            webbrowser.open(url)
-            code = get_code()
-            payload = {
-                'client_id':        self.client_id,
-                'client_secret':    self.client_secret,
-                'grant_type':       'authorization_code',
-                'code':             code,
-                'redirect_uri':     'http://localhost:7270'
-            }
-
-        response = requests.post(endpoint, data=payload)
-        data = json.loads(response.text)
-        token_type = data['token_type']
-        access_token = data['access_token']
-
-        headers = {'Authorization': f'{token_type} {access_token}'}
-        return headers
-
-    async def ensure_rate_limit(self):
-        self.index = (self.index + 1) % (OSU_RATE_LIMIT - 1)
-        difference = time() - self.times[self.index]
-        if difference < 60:
-            await asyncio.sleep(60 - difference)
-        self.times[self.index] = time()
+    async def ensure_rate_limit(self, priority=Priority.DEFAULT):
+        start = perf_counter()
+        with tracing.span('rate limit', priority=priority.name.lower()):
+            await self.limiter.acquire(priority)
+        metrics.RATE_LIMIT_WAIT.observe(perf_counter() - start, priority=priority.name.lower())
 
     def get_current_rate(self):
-        previous_minute = np.where(time() - self.times <= 60)[0]
-        indices = (self.index - previous_minute) % (OSU_RATE_LIMIT - 1)
-        if len(indices) > 0:
-            return indices.max() + 1
+        return self.limiter.current_rate()
 
-    async def request(self, endpoint, parameters={}, version=OsuAPIVersion.V2):
-        await self.ensure_rate_limit()
+    async def request(self, endpoint, parameters={}, version=OsuAPIVersion.V2,
+                      priority=Priority.DEFAULT):
+        async def request():
+            return await self._request(endpoint, parameters, version, priority)
 
-        if version is OsuAPIVersion.V1:
-            url = f'{V1_URL}/{endpoint}'
-            parameters['k'] = self.key
-            async with self.session.get(url, params=parameters) as response:
-                data = json.loads(await response.text())
+        return await self.responses.fetch(endpoint, parameters, version, request, priority)
 
+    async def _request(self, endpoint, parameters, version, priority):
+        if version is OsuAPIVersion.V1:
+            url = f'{v1_url()}/{endpoint}'
+            parameters = {**parameters, 'k': self.key}
         else:
-            url = f'{V2_URL}/{endpoint}'
-            try:
-                async with self.session.get(url, params=parameters, headers=self.headers) as response:
-                    data = json.loads(await response.text())
-            except json.JSONDecodeError:
-                return None
-
-        return data
+            url = f'{v2_url()}/{endpoint}'
 
-    async def download_replay(self, score_id):
-        await self.ensure_rate_limit()
+        async def before():
+            await self.ensure_rate_limit(priority)
+            if version is OsuAPIVersion.V2:
+                await self.auth.ensure()
 
-        replay_path = (Path('output') / str(score_id)).with_suffix('.osr')
-        endpoint = f'{V2_URL}/scores/osu/{score_id}/download'
-        async with self.session.get(endpoint, headers=self.headers) as response:
-            async with aiofiles.open(replay_path, 'wb') as replay:
-                await replay.write(await response.read())
-        return replay_path
+        label = metrics.endpoint_label(endpoint)
 
-    async def username_to_id(self, username):
+        async def get():
+            headers = self.headers if version is OsuAPIVersion.V2 else None
+            start = perf_counter()
+            try:
+                async with self.session.get(url, params=parameters, headers=headers) as response:
+                    metrics.REQUESTS.inc(endpoint=label, status=response.status)
+                    check_status(response)
+                    return await response.read()
+            except Exception as e:
+                metrics.REQUEST_ERRORS.inc(endpoint=label, error=type(e).__name__)
+                raise
+            finally:
+                metrics.REQUEST_LATENCY.observe(perf_counter() - start, endpoint=label)
+
+        with tracing.span(f'api {label}'):
+            body = await retry(get, before)
+        try:
+            return json.loads(body)
+        except json.JSONDecodeError:
+            return None
+
+    async def download_replay(self, score_id, priority=Priority.POST, owner=None):
+        async def before():
+            await self.ensure_rate_limit(priority)
+            await self.auth.ensure()
+
+        endpoint = f'{v2_url()}/scores/osu/{score_id}/download'
+        with tracing.span('download replay', score_id=score_id):
+            return await self.downloads.fetch(self.session, endpoint, 'replays', score_id, '.osr',
+                                              headers=lambda: self.headers, before=before,
+                                              owner=owner)
+
+    async def download_cover(self, beatmapset_id, cover_url, owner=None):
+        with tracing.span('download cover', beatmapset_id=beatmapset_id):
+            return await self.downloads.fetch(self.session, cover_url, 'covers', beatmapset_id, '.jpg',
+                                              owner=owner)
+
+    async def username_to_id(self, username, priority=Priority.DEFAULT):
         parameters = {
             'u':        username,
             'type':     'string'
         }
 
-        data = await self.request('get_user', parameters, OsuAPIVersion.V1)
+        data = await self.request('get_user', parameters, OsuAPIVersion.V1, priority)
         return int(data[0]['user_id'])
 
 
-def refresh_db(db_path=OSU_PATH / 'osu!.db'):
-    from osu_db_tools.osu_to_sqlite import create_db
-    create_db(db_path)
-
-
-def get_code():
-    code = None
-    running = True
-
-    class Server(BaseHTTPRequestHandler):
-        def do_GET(self):
-            nonlocal code, running
-
-            response = b'<body onload="window.close()" />'
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.send_header("Content-length", len(response))
-            self.end_headers()
-            self.wfile.write(response)
-
-            components = urlparse(self.path)
-            values = parse_qs(components.query)
-            code = values['code'][0]
-            running = False
-
-        def log_message(self, *args):
-            return
-
-    server = HTTPServer(('localhost', 7270), Server)
-    while running:
-        server.handle_request()
+def refresh_db():
+    return get_beatmaps().scan()
 
-    return code
@@ -0,0 +1,102 @@
+import asyncio
+import os
+from pathlib import Path
+from time import time_ns
+
+from replays import ReplayIndex
+
+REPLAY_SUFFIX = '.osr'
+POLL_INTERVAL = 0.5
+SETTLE_INTERVAL = 0.1
+RESCAN_WINDOW = 2 * 10**9
+
+
+def list_replays(directory):
+    with os.scandir(directory) as entries:
+        return {entry.name for entry in entries if entry.name.endswith(REPLAY_SUFFIX)}
+
+
+def latest_replay(directory):
+    index = ReplayIndex(directory)
+    index.update(rescan=False)
+    replay = index.latest()
+    if replay is None:
+        raise FileNotFoundError(f"No replays in {directory}")
+    return replay.path
+
+
+class ReplayWatcher:
+
+    def __init__(self, directory, poll_interval=POLL_INTERVAL):
+        self.directory = Path(directory)
+        self.poll_interval = poll_interval
+        self.known = list_replays(self.directory)
+        self.queue = None
+
+    def _notify(self, path):
+        path = Path(path)
+        if path.suffix == REPLAY_SUFFIX and path.name not in self.known:
+            self.known.add(path.name)
+            self.queue.put_nowait(path)
+
+    def _observe(self, loop):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+
+        notify = self._notify
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                path = getattr(event, 'dest_path', None) or event.src_path
+                loop.call_soon_threadsafe(notify, path)
+
+        observer = Observer()
+        observer.schedule(Handler(), str(self.directory))
+        observer.start()
+        return observer
+
+    async def _poll(self):
+        mtime = None
+        while True:
+            current = self.directory.stat().st_mtime_ns
+            if current != mtime or time_ns() - current < RESCAN_WINDOW:
+                mtime = current
+                for name in sorted(list_replays(self.directory) - self.known):
+                    self._notify(self.directory / name)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _wait_until_written(self, path):
+        size = -1
+        while True:
+            try:
+                current = path.stat().st_size
+            except FileNotFoundError:
+                return False
+            if current == size and current > 0:
+                return True
+            size = current
+            await asyncio.sleep(SETTLE_INTERVAL)
+
+    async def __aiter__(self):
+        self.queue = asyncio.Queue()
+        observer = self._observe(asyncio.get_running_loop())
+        poller = None
+        if observer is None:
+            poller = asyncio.create_task(self._poll())
+
+        try:
+            while True:
+                path = await self.queue.get()
+                if await self._wait_until_written(path):
+                    yield path
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            if poller is not None:
+                poller.cancel()
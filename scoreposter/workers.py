@@ -0,0 +1,141 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+
+import utils
+
+
+class AnalysisJob:
+
+    def __init__(self, replay_path, map_path, mods, combo, misses, accuracy):
+        self.replay_path = replay_path
+        self.map_path = map_path
+        self.mods = mods
+        self.combo = combo
+        self.misses = misses
+        self.accuracy = accuracy
+
+
+class AnalysisResult:
+
+    def __init__(self, sliderbreaks, max_combo, pp, fcpp, ur):
+        self.sliderbreaks = sliderbreaks
+        self.max_combo = max_combo
+        self.pp = pp
+        self.fcpp = fcpp
+        self.ur = ur
+
+
+def count_sliderbreaks(replay_path, map_path):
+    from slider.beatmap import Beatmap
+    from slider.replay import Replay
+    replay = Replay.from_path(
+        replay_path,
+        beatmap=Beatmap.from_path(map_path),
+        retrieve_beatmap=False)
+    return len(replay.hits['slider_breaks'])
+
+
+def calculate_pp(map_path, mods, combo, misses, accuracy):
+    import oppai
+    ez = oppai.ezpp_new()
+    oppai.ezpp_set_autocalc(ez, 1)
+
+    with open(map_path, encoding='utf-8') as file:
+        data = file.read()
+    oppai.ezpp_data_dup(ez, data, len(data.encode('utf-8')))
+    oppai.ezpp_set_mods(ez, reduce(lambda a, v: a | v.value, mods, 0))
+
+    max_combo = max(combo, oppai.ezpp_max_combo(ez))
+
+    oppai.ezpp_set_combo(ez, combo)
+    oppai.ezpp_set_nmiss(ez, misses)
+    oppai.ezpp_set_accuracy_percent(ez, accuracy)
+    pp = oppai.ezpp_pp(ez)
+
+    oppai.ezpp_set_combo(ez, max_combo)
+    oppai.ezpp_set_nmiss(ez, 0)
+    fcpp = oppai.ezpp_pp(ez)
+
+    oppai.ezpp_free(ez)
+    return max_combo, pp, fcpp
+
+
+def calculate_stars(map_path, mods):
+    import oppai
+    ez = oppai.ezpp_new()
+    with open(map_path, encoding='utf-8') as file:
+        data = file.read()
+    oppai.ezpp_set_mods(ez, reduce(lambda a, v: a | v.value, mods, 0))
+    oppai.ezpp_data_dup(ez, data, len(data.encode('utf-8')))
+    stars = oppai.ezpp_stars(ez)
+    oppai.ezpp_free(ez)
+    return stars
+
+
+def calculate_ur(replay_path, cg_replay=None, map_path=None):
+    if cg_replay is None:
+        from circleguard import ReplayPath
+        cg_replay = ReplayPath(replay_path)
+    beatmap = None
+    if map_path is not None:
+        from slider.beatmap import Beatmap
+        beatmap = Beatmap.from_path(map_path)
+    return utils.get_cg().ur(cg_replay, beatmap=beatmap)
+
+
+def analyze(job):
+    sliderbreaks = count_sliderbreaks(job.replay_path, job.map_path)
+    max_combo, pp, fcpp = calculate_pp(job.map_path, job.mods, job.combo,
+                                       job.misses, job.accuracy)
+    ur = calculate_ur(job.replay_path, map_path=job.map_path)
+    return AnalysisResult(sliderbreaks, max_combo, pp, fcpp, ur)
+
+
+class AnalysisPool:
+
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size or 2*self.workers
+        self.executor = None
+        self.queue = None
+        self.dispatchers = []
+
+    async def __aenter__(self):
+        self.executor = ProcessPoolExecutor(self.workers)
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.dispatchers = [asyncio.create_task(self._dispatch())
+                            for _ in range(self.workers)]
+        return self
+
+    async def __aexit__(self, *args):
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.dispatchers = []
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, future = await self.queue.get()
+            try:
+                result = await loop.run_in_executor(self.executor, analyze, job)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+    async def submit(self, job):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((job, future))
+        return future
+
+    async def analyze(self, job):
+        return await (await self.submit(job))